@@ -0,0 +1,193 @@
+# audio.py
+
+import re
+import json
+import shutil
+import asyncio
+
+# Audio output engine: ffprobe the source, stream-copy when the codec is one
+# Telegram plays as an audio track (AAC -> m4a, MP3 -> mp3), and re-encode to
+# MP3 otherwise. Opus/Vorbis in .ogg would arrive as a document, not a track.
+# Copies cost almost no CPU; every ffmpeg run is timed with -benchmark so the
+# CPU actually spent, and an estimate of what the copies saved, can be reported.
+
+MP3_ARGS = ["-vn", "-c:a", "libmp3lame", "-b:a", "192k", "-ar", "44100", "-f", "mp3"]
+COPY_PLANS = {
+    # codec: (ext, ffmpeg output args)
+    "aac": ("m4a", ["-vn", "-c:a", "copy", "-bsf:a", "aac_adtstoasc", "-movflags", "+faststart", "-f", "ipod"]),
+    "mp3": ("mp3", ["-vn", "-c:a", "copy", "-f", "mp3"]),
+}
+# yt-dlp acodec strings -> ffprobe codec names, used when ffprobe is missing
+ACODEC_HINTS = {"mp4a": "aac", "aac": "aac", "mp3": "mp3", "opus": "opus", "vorbis": "vorbis"}
+DEFAULT_ENCODE_RATE = 0.03  # CPU seconds per media second for a 192k MP3 encode, until measured
+STREAM_CHUNK = 256 * 1024
+HEAD_BYTES = 256 * 1024  # enough to find an MP4's top-level boxes
+
+_BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+
+def plan(codec, force_mp3=False):
+    # -> (ext, args, copied)
+    if codec in COPY_PLANS and (not force_mp3 or codec == "mp3"):
+        ext, args = COPY_PLANS[codec]
+        return ext, args, True
+    return "mp3", MP3_ARGS, False
+
+def codec_from_hint(acodec):
+    if not acodec or acodec == "none":
+        return None
+    return ACODEC_HINTS.get(acodec.split(".", 1)[0].lower())
+
+
+def pipeable(head):
+    # Can ffmpeg decode this from a pipe? Walks the top-level MP4 boxes in the
+    # file's first bytes: the index (moov) must come before the media (mdat).
+    # Other containers stream fine; an unreadable head means "spool to disk".
+    if len(head) < 8:
+        return False
+    if head[4:8] != b"ftyp":
+        return True
+    pos = 0
+    while pos + 8 <= len(head):
+        size, kind = int.from_bytes(head[pos:pos + 4], "big"), head[pos + 4:pos + 8]
+        if kind == b"moov":
+            return True
+        if kind == b"mdat":
+            return False
+        if size == 1 and pos + 16 <= len(head):
+            size = int.from_bytes(head[pos + 8:pos + 16], "big")
+        if size < 8:
+            return False
+        pos += size
+    return False
+
+
+async def run_ffmpeg(src, output_file, args, resp=None):
+    # -> (ok, cpu_seconds). src "pipe:0" streams resp's body into ffmpeg;
+    # stdin.drain() keeps memory bounded
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-hide_banner", "-nostats", "-loglevel", "info", "-benchmark",
+        "-i", src, *args, output_file,
+        stdin=asyncio.subprocess.PIPE if resp is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    err_task = asyncio.create_task(proc.stderr.read())
+    try:
+        if resp is not None:
+            try:
+                async for chunk in resp.content.iter_chunked(STREAM_CHUNK):
+                    proc.stdin.write(chunk)
+                    await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg stopped reading, its exit code tells why
+            finally:
+                proc.stdin.close()
+        await proc.wait()
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    err = (await err_task).decode(errors="ignore").strip()
+    m = _BENCH_RE.search(err)
+    cpu = float(m.group(1)) + float(m.group(2)) if m else None
+    if proc.returncode != 0:
+        print(f"ffmpeg ({src}) exit {proc.returncode}:", err[-300:])
+    return proc.returncode == 0, cpu
+
+
+class AudioEngine:
+    def __init__(self, force_mp3=False, encode_slots=None):
+        self.force_mp3 = force_mp3
+        self.has_ffprobe = shutil.which("ffprobe") is not None
+        self.encode_slots = encode_slots or asyncio.Semaphore(1)  # encodes are CPU bound, copies are not
+        self.copies = 0
+        self.encodes = 0
+        self.cpu_spent = 0.0
+        self.cpu_saved = 0.0
+        self._encode_cpu = 0.0  # measured encodes: CPU seconds
+        self._encode_media = 0.0  # ... over this many media seconds
+
+    @property
+    def encode_rate(self):
+        return self._encode_cpu / self._encode_media if self._encode_media else DEFAULT_ENCODE_RATE
+
+    async def probe(self, src, data=None):
+        # -> (codec, duration); (None, None) when ffprobe is missing or fails.
+        # src "pipe:0" reads data, a remote file's first bytes, over stdin:
+        # file URLs carry the bot token and must stay out of the process list
+        if not self.has_ffprobe:
+            return None, None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "error", "-select_streams", "a:0",
+                "-show_entries", "stream=codec_name:format=duration", "-of", "json", src,
+                stdin=asyncio.subprocess.PIPE if data is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            out, _ = await asyncio.wait_for(proc.communicate(data), 30)
+            data = json.loads(out or b"{}")
+        except Exception as e:
+            print("ffprobe failed:", e)
+            return None, None
+        streams = data.get("streams") or [{}]
+        try:
+            duration = float((data.get("format") or {}).get("duration"))
+        except (TypeError, ValueError):
+            duration = None
+        return streams[0].get("codec_name"), duration
+
+    def plan(self, codec):
+        return plan(codec, self.force_mp3)
+
+    async def transcode(self, src, output_file, args, copied, duration=None, resp=None):
+        # Runs one planned conversion and books its CPU cost
+        if copied:
+            ok, cpu = await run_ffmpeg(src, output_file, args, resp)
+        else:
+            async with self.encode_slots:
+                ok, cpu = await run_ffmpeg(src, output_file, args, resp)
+        if ok:
+            self._account(copied, cpu, duration)
+        return ok
+
+    async def extract(self, src, out_base, hint=None):
+        # File in, audio file out: -> (path, codec, copied)
+        codec, duration = await self.probe(src)
+        codec = codec or codec_from_hint(hint)
+        ext, args, copied = self.plan(codec)
+        output_file = f"{out_base}.{ext}"
+        if not await self.transcode(src, output_file, args, copied, duration):
+            if not copied:
+                raise Exception("ffmpeg audio encode failed")
+            # Container quirks can break a copy; an encode always works
+            ext, args, copied = "mp3", MP3_ARGS, False
+            output_file = f"{out_base}.{ext}"
+            if not await self.transcode(src, output_file, args, copied, duration):
+                raise Exception("ffmpeg audio encode failed")
+        return output_file, codec, copied
+
+    def _account(self, copied, cpu, duration):
+        cpu = cpu or 0.0
+        self.cpu_spent += cpu
+        if copied:
+            self.copies += 1
+            if duration:
+                self.cpu_saved += max(0.0, duration * self.encode_rate - cpu)
+        else:
+            self.encodes += 1
+            if duration and cpu:
+                self._encode_cpu += cpu
+                self._encode_media += duration
+
+    def stats(self):
+        return {
+            "copies": self.copies,
+            "encodes": self.encodes,
+            "cpu_spent": self.cpu_spent,
+            "cpu_saved": self.cpu_saved,
+            "encode_rate": self.encode_rate,
+            "force_mp3": self.force_mp3,
+        }
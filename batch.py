@@ -0,0 +1,74 @@
+# batch.py
+
+import asyncio
+
+ALBUM_MAX = 10  # Telegram's media group limit
+
+
+class BatchItem:
+    __slots__ = ("url", "platform", "path", "file_id", "title", "size_mb", "cache_key", "job_dir", "job_id")
+
+    def __init__(self, url, platform, title, size_mb, cache_key, path=None, file_id=None, job_dir=None, job_id=None):
+        self.url = url
+        self.platform = platform
+        self.title = title
+        self.size_mb = size_mb
+        self.cache_key = cache_key
+        self.path = path          # downloaded file, or
+        self.file_id = file_id    # cached Telegram file_id
+        self.job_dir = job_dir    # scratch dir handed over by the worker, released after sending
+        self.job_id = job_id      # journal row, finished once the album is out
+
+
+# Collects the results of one "All Video / All Audio" tap. Workers add
+# finished items (or report failures) as they go; full albums are sent as
+# soon as ALBUM_MAX items are ready and the remainder once every link is
+# accounted for, so the user sees a few albums and one status message
+# instead of a keyboard, four edits and an upload per link.
+class Batch:
+    def __init__(self, total, media_type, flush, on_progress=None):
+        self.total = total
+        self.media_type = media_type
+        self._flush = flush              # async (items) -> number of items delivered
+        self._on_progress = on_progress  # (batch) -> None, e.g. a coalesced status edit
+        self._ready = []
+        self._lock = asyncio.Lock()
+        self.accounted = 0  # items that finished downloading or failed
+        self.sent = 0
+        self.failed = 0
+        self.too_large = 0
+
+    @property
+    def pending(self):
+        return self.total - self.accounted + len(self._ready)
+
+    @property
+    def finished(self):
+        return self.accounted >= self.total and not self._ready
+
+    async def add(self, item):
+        self._ready.append(item)
+        self.accounted += 1
+        await self._advance()
+
+    async def fail(self, too_large=False):
+        if too_large:
+            self.too_large += 1
+        else:
+            self.failed += 1
+        self.accounted += 1
+        await self._advance()
+
+    async def _advance(self):
+        async with self._lock:
+            while len(self._ready) >= ALBUM_MAX or (self._ready and self.accounted >= self.total):
+                group, self._ready = self._ready[:ALBUM_MAX], self._ready[ALBUM_MAX:]
+                try:
+                    delivered = await self._flush(group)
+                except Exception as e:
+                    print("Batch album send failed:", e)
+                    delivered = 0
+                self.sent += delivered
+                self.failed += len(group) - delivered
+        if self._on_progress:
+            self._on_progress(self)
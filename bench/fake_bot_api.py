@@ -0,0 +1,191 @@
+# bench/fake_bot_api.py
+
+import json
+import time
+import asyncio
+import itertools
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+# Just enough of the Bot API for main.py to run against: long-polled
+# getUpdates, message sends/edits and uploads. Every call the bot makes is
+# handed to the waiters registered with expect(), which is how the load
+# generator sees replies without touching real Telegram.
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+SEND_KINDS = {"sendVideo": "video", "sendAudio": "audio", "sendDocument": "document", "sendAnimation": "animation", "sendVoice": "voice"}
+
+
+class Call:
+    __slots__ = ("method", "params", "at")
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.at = time.monotonic()
+
+    @property
+    def chat_id(self):
+        try:
+            return int(self.params.get("chat_id"))
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def text(self):
+        return self.params.get("text") or self.params.get("caption") or ""
+
+
+class FakeBotAPI:
+    def __init__(self, file_fixture=None):
+        self.file_fixture = file_fixture  # served for every getFile download
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+        self._waiters = []  # (predicate, future)
+        self.polled = asyncio.Event()  # set on the bot's first getUpdates
+        self.calls = {}
+        self.upload_bytes = 0
+        self.app = web.Application(client_max_size=0)
+        self.app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self.app.router.add_get("/file/bot{token}/{path:.*}", self._serve_file)
+
+    # ===== Load generator side =====
+    def push_message(self, user_id, text):
+        msg = self._message(user_id, text=text)
+        msg["from"] = self._user(user_id)
+        self._push({"message": msg})
+        return msg
+
+    def push_callback(self, user_id, message_id, data):
+        self._push({"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self._user(user_id),
+            "message": dict(self._message(user_id, message_id=message_id, text="."), **{"from": BOT_USER}),
+            "chat_instance": str(user_id),
+            "data": data,
+        }})
+
+    def expect(self, predicate):
+        # Register before pushing the update that triggers the reply
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((predicate, fut))
+        return fut
+
+    def _push(self, update):
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_update.set()
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _message(self, chat_id, message_id=None, **fields):
+        msg = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        }
+        msg.update(fields)
+        return msg
+
+    # ===== Bot side =====
+    async def _params(self, request):
+        params = dict(request.query)
+        # telebot sends form bodies even on GET, so parse whatever arrived
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename is None:
+                    params[part.name] = await part.text()
+                    continue
+                size = 0
+                while True:
+                    chunk = await part.read_chunk()
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                self.upload_bytes += size
+                params[part.name] = {"filename": part.filename, "size": size}
+        elif request.can_read_body:
+            body = await request.text()
+            if request.content_type == "application/json":
+                params.update(json.loads(body or "{}"))
+            else:
+                params.update(parse_qsl(body, keep_blank_values=True))
+        return params
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+
+        call = Call(method, params)
+        result = self._result(call)
+        for waiter in list(self._waiters):
+            predicate, fut = waiter
+            if fut.done():
+                self._waiters.remove(waiter)
+            elif predicate(call, result):
+                self._waiters.remove(waiter)
+                fut.set_result((call, result))
+        return self._ok(result)
+
+    async def _get_updates(self, params):
+        self.polled.set()
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout") or 0) or 0.1)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit") or 100)]
+
+    def _result(self, call):
+        method, params = call.method, call.params
+        chat_id = call.chat_id or 0
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendMessage":
+            msg = self._message(chat_id, text=params.get("text", ""))
+            if params.get("reply_markup"):
+                msg["reply_markup"] = json.loads(params["reply_markup"])
+            return msg
+        if method == "editMessageText":
+            return self._message(chat_id, int(params.get("message_id") or 0), text=params.get("text", ""))
+        if method in SEND_KINDS:
+            return self._message(chat_id, **{SEND_KINDS[method]: self._file(params.get(SEND_KINDS[method]))})
+        if method == "sendPhoto":
+            photo = dict(self._file(params.get("photo")), width=320, height=180)
+            return self._message(chat_id, photo=[photo])
+        if method == "getFile":
+            return {"file_id": params.get("file_id"), "file_unique_id": params.get("file_id"), "file_path": f"files/{params.get('file_id')}"}
+        return True
+
+    def _file(self, value):
+        if isinstance(value, str):  # resend by file_id
+            return {"file_id": value, "file_unique_id": value, "width": 640, "height": 360, "duration": 10}
+        n = next(self._file_ids)
+        return {
+            "file_id": f"F{n}",
+            "file_unique_id": f"U{n}",
+            "file_size": (value or {}).get("size", 0),
+            "width": 640,
+            "height": 360,
+            "duration": 10,
+        }
+
+    async def _serve_file(self, request):
+        if not self.file_fixture:
+            raise web.HTTPNotFound()
+        return web.FileResponse(self.file_fixture)
+
+    def _ok(self, result):
+        return web.json_response({"ok": True, "result": result})
@@ -0,0 +1,72 @@
+# bench/media_server.py
+
+import os
+import shutil
+import subprocess
+
+from aiohttp import web
+
+# Serves media fixtures for yt-dlp to pull from, either as direct file URLs
+# (/media/<name>) or wrapped in an HTML5 <video> page (/page/<name>) so the
+# generic extractor has to parse it. FileResponse handles Range requests,
+# which yt-dlp uses for chunked and resumed downloads.
+
+FIXTURES = {
+    # name: (seconds, video size)
+    "short.mp4": (10, "640x360"),
+    "long.mp4": (60, "1280x720"),
+}
+
+
+def make_fixtures(directory):
+    os.makedirs(directory, exist_ok=True)
+    ffmpeg = shutil.which("ffmpeg")
+    for name, (seconds, size) in FIXTURES.items():
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            continue
+        if ffmpeg:
+            subprocess.run([
+                ffmpeg, "-y", "-loglevel", "error",
+                "-f", "lavfi", "-i", f"testsrc=duration={seconds}:size={size}:rate=30",
+                "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", path,
+            ], check=True)
+        else:
+            # No ffmpeg: still exercises download/upload, not audio extraction
+            print(f"[bench] ffmpeg not found, writing random bytes to {name}")
+            with open(path, "wb") as f:
+                f.write(os.urandom(seconds * 100_000))
+    return directory
+
+
+class MediaServer:
+    def __init__(self, directory):
+        self.directory = directory
+        self.requests = 0
+        self.bytes_sent = 0
+        self.app = web.Application()
+        self.app.router.add_get("/media/{name}", self._media)
+        self.app.router.add_get("/page/{name}", self._page)
+
+    def _path(self, name):
+        path = os.path.join(self.directory, os.path.basename(name))
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        return path
+
+    async def _media(self, request):
+        path = self._path(request.match_info["name"])
+        self.requests += 1
+        self.bytes_sent += os.path.getsize(path)  # upper bound when Range is used
+        return web.FileResponse(path)
+
+    async def _page(self, request):
+        name = request.match_info["name"]
+        self._path(name)
+        html = (
+            f"<html><head><title>{name}</title></head><body>"
+            f'<video controls><source src="/media/{name}" type="video/mp4"></video>'
+            "</body></html>"
+        )
+        return web.Response(text=html, content_type="text/html")
@@ -0,0 +1,301 @@
+# bench/run.py
+#
+# Offline end-to-end benchmark: runs main.py against a fake Bot API and a
+# local media server, drives N simulated users through "send link -> tap
+# Video/Audio -> receive file", and reports throughput, tap-to-send latency,
+# peak RSS and peak TMP_DIR usage. Nothing leaves localhost.
+#
+#   python bench/run.py --users 20 --links 3 --workers 12
+#   python bench/run.py --kind audio --mode page --fixture long.mp4
+#   python bench/run.py --same-link          # exercise coalescing / file_id cache
+#   python bench/run.py --json out.json      # machine-readable, for comparing runs
+#
+# Needs the bot's own requirements plus ffmpeg for real fixtures.
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from aiohttp import web
+
+from fake_bot_api import FakeBotAPI, SEND_KINDS
+from media_server import MediaServer, make_fixtures, FIXTURES
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "123456:BENCH"
+COOLDOWN = 3.2  # main.py COOLDOWN_SECONDS plus slack
+SAMPLE_INTERVAL = 0.25
+FAIL_MARKS = ("❌", "🚦")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def serve(app, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+# ===== Resource sampling =====
+def proc_status(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def process_tree(root):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+def dir_size(path):
+    total = 0
+    for base, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(base, name))
+            except OSError:
+                pass
+    return total
+
+async def sampler(pid, tmp_dir, peaks, stop):
+    while not stop.is_set():
+        rss = sum(proc_status(p, "VmRSS") for p in process_tree(pid))
+        peaks["tree_rss"] = max(peaks["tree_rss"], rss)
+        peaks["bot_rss"] = max(peaks["bot_rss"], proc_status(pid, "VmHWM"))
+        peaks["tmp_bytes"] = max(peaks["tmp_bytes"], await asyncio.to_thread(dir_size, tmp_dir))
+        try:
+            await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ===== Simulated user =====
+async def simulate_user(api, uid, urls, kind, timeout, results):
+    last_sent = -COOLDOWN
+    for i, url in enumerate(urls):
+        await asyncio.sleep(max(0, last_sent + COOLDOWN - time.monotonic()))
+        keyboard = api.expect(lambda c, r: c.method == "sendMessage" and c.chat_id == uid and "reply_markup" in c.params)
+        api.push_message(uid, url)
+        last_sent = time.monotonic()
+        try:
+            call, sent = await asyncio.wait_for(keyboard, timeout)
+        except asyncio.TimeoutError:
+            results.append({"user": uid, "ok": False, "latency": None, "error": "no keyboard"})
+            continue
+
+        markup = json.loads(call.params["reply_markup"])
+        buttons = [b.get("callback_data", "") for row in markup["inline_keyboard"] for b in row]
+        media = kind if kind != "mix" else ("video", "audio")[(uid + i) % 2]
+        data = next((d for d in buttons if d.startswith(media[0] + "_")), None)
+        if data is None:
+            results.append({"user": uid, "ok": False, "latency": None, "error": "no button"})
+            continue
+
+        done = api.expect(lambda c, r: c.chat_id == uid and (
+            c.method in SEND_KINDS
+            or (c.method in ("editMessageText", "sendMessage") and c.text.startswith(FAIL_MARKS))
+        ))
+        tapped = time.monotonic()
+        api.push_callback(uid, sent["message_id"], data)
+        try:
+            call, _ = await asyncio.wait_for(done, timeout)
+        except asyncio.TimeoutError:
+            results.append({"user": uid, "ok": False, "latency": None, "error": "timeout"})
+            continue
+        ok = call.method in SEND_KINDS and not call.text.startswith(FAIL_MARKS)
+        results.append({
+            "user": uid,
+            "ok": ok,
+            "media": media,
+            "latency": call.at - tapped,
+            "tapped": tapped,
+            "finished": call.at,
+            "error": None if ok else call.text.split("\n", 1)[0],
+        })
+
+
+# ===== Run =====
+async def run(args):
+    work = tempfile.mkdtemp(prefix="tbbench-")
+    data_dir = os.path.join(work, "data")
+    tmp_dir = os.path.join(work, "tmp")
+    os.makedirs(data_dir)
+    os.makedirs(tmp_dir)
+    fixtures = make_fixtures(args.fixtures_dir)
+
+    api = FakeBotAPI(file_fixture=os.path.join(fixtures, args.fixture))
+    media = MediaServer(fixtures)
+    api_port, media_port, health_port = free_port(), free_port(), free_port()
+    runners = [await serve(api.app, api_port), await serve(media.app, media_port)]
+
+    env = dict(os.environ)
+    env.update({
+        "API_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "DATA_DIR": data_dir,
+        "TMP_DIR": tmp_dir,
+        "MAX_WORKERS": str(args.workers),
+        "EXTRA_PLATFORM_HOSTS": "127.0.0.1=tiktok",  # any platform main.py knows
+        "PORT": str(health_port),
+        "DRAIN_TIMEOUT": "5",
+        "PYTHONUNBUFFERED": "1",
+    })
+    log_path = os.path.join(work, "bot.log")
+    log = open(log_path, "wb")
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, "main.py"], cwd=REPO, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    peaks = {"tree_rss": 0, "bot_rss": 0, "tmp_bytes": 0}
+    stop = asyncio.Event()
+    sampling = asyncio.create_task(sampler(proc.pid, tmp_dir, peaks, stop))
+    results = []
+    try:
+        await asyncio.wait_for(api.polled.wait(), args.startup_timeout)
+        startup = time.monotonic() - started
+
+        path = "page" if args.mode == "page" else "media"
+        base = f"http://127.0.0.1:{media_port}/{path}/{args.fixture}"
+        users = []
+        for n in range(args.users):
+            uid = 1000 + n
+            urls = [base if args.same_link else f"{base}?u={uid}&n={i}" for i in range(args.links)]
+            users.append(simulate_user(api, uid, urls, args.kind, args.job_timeout, results))
+        await asyncio.gather(*users)
+    except asyncio.TimeoutError:
+        print(f"[bench] bot did not start polling within {args.startup_timeout}s, see {log_path}")
+        startup = None
+    finally:
+        stop.set()
+        await sampling
+        shutdown(proc)
+        log.close()
+        for runner in runners:
+            await runner.cleanup()
+
+    report = summarize(results, peaks, api, media, startup, args)
+    report["log"] = log_path
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.keep:
+        print(f"[bench] work dir kept at {work}")
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    return report
+
+def shutdown(proc):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            pass
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)  # engine processes included
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+def summarize(results, peaks, api, media, startup, args):
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    if ok:
+        span = max(r["finished"] for r in ok) - min(r["tapped"] for r in ok)
+    else:
+        span = 0.0
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "startup_seconds": startup,
+        "jobs": len(results),
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "errors": errors,
+        "jobs_per_sec": len(ok) / span if span else 0.0,
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "peak_rss_bot_mb": peaks["bot_rss"] / 1024 / 1024,
+        "peak_rss_tree_mb": peaks["tree_rss"] / 1024 / 1024,
+        "peak_tmp_mb": peaks["tmp_bytes"] / 1024 / 1024,
+        "uploaded_mb": api.upload_bytes / 1024 / 1024,
+        "media_requests": media.requests,
+        "api_calls": dict(api.calls),
+    }
+
+def print_report(r):
+    lat = r["latency"]
+    print("===== tbloader bench =====")
+    print(f"config      : {r['config']}")
+    if r["startup_seconds"] is not None:
+        print(f"startup     : {r['startup_seconds']:.2f}s to first getUpdates")
+    print(f"jobs        : {r['ok']} ok / {r['failed']} failed  {r['errors'] or ''}")
+    print(f"throughput  : {r['jobs_per_sec']:.2f} jobs/s")
+    print(f"tap->send   : p50 {lat['p50']:.2f}s  p95 {lat['p95']:.2f}s  p99 {lat['p99']:.2f}s  max {lat['max']:.2f}s")
+    print(f"peak RSS    : bot {r['peak_rss_bot_mb']:.1f} MB, process tree {r['peak_rss_tree_mb']:.1f} MB")
+    print(f"peak tmp    : {r['peak_tmp_mb']:.1f} MB")
+    print(f"uploaded    : {r['uploaded_mb']:.1f} MB in {sum(r['api_calls'].get(m, 0) for m in SEND_KINDS)} sends")
+    print(f"bot log     : {r['log']}")
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Offline load test for main.py")
+    p.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    p.add_argument("--links", type=int, default=3, help="links sent by each user, one after another")
+    p.add_argument("--workers", type=int, default=12, help="MAX_WORKERS for the bot")
+    p.add_argument("--kind", choices=("video", "audio", "mix"), default="video")
+    p.add_argument("--mode", choices=("direct", "page"), default="direct", help="direct file URL or HTML5 page for the generic extractor")
+    p.add_argument("--fixture", choices=sorted(FIXTURES), default="short.mp4")
+    p.add_argument("--same-link", action="store_true", help="every user sends the same URL")
+    p.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "tbbench-fixtures"))
+    p.add_argument("--startup-timeout", type=float, default=60)
+    p.add_argument("--job-timeout", type=float, default=300)
+    p.add_argument("--json", help="also write the report to this file")
+    p.add_argument("--keep", action="store_true", help="keep the work dir (bot log, data, tmp)")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,223 @@
+# broker.py
+
+import time
+import asyncio
+
+from journal import JobJournal, JournalEntry, FIELDS, PENDING, QUEUED, JOINED, DONE
+from scheduler import QueueFull, PRIO_NORMAL
+
+WORKERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    busy INTEGER NOT NULL DEFAULT 0,
+    capacity INTEGER NOT NULL DEFAULT 0
+);
+"""
+ACTIVE = ("claimed", "extracting", "downloading", "uploading")
+CLAIMED = "claimed"
+
+
+# The job journal doubling as a work queue shared by processes (and nodes, when
+# DATA_DIR is a shared volume with working POSIX locks). A frontend inserts
+# pending rows and queues them once admitted; worker processes claim them in a
+# BEGIN IMMEDIATE transaction, hold them under a lease their heartbeat keeps
+# extending, and write the outcome back. A job whose lease runs out (worker
+# killed, node gone) is put back in the queue for someone else.
+class JobBroker(JobJournal):
+    def open(self):
+        super().open()
+        self._db.executescript(WORKERS_SCHEMA)
+
+    def _wait(self, future, default=None):
+        # For the callers that need the answer; they run in a thread, not on the loop
+        return future.result() if future is not None else default
+
+    # ===== Frontend side =====
+    def _check(self, db, user_id, capacity, per_user):
+        total, mine = db.execute("SELECT COUNT(*), SUM(user_id = ?) FROM jobs WHERE state = ?", (user_id, QUEUED)).fetchone()
+        if total >= capacity:
+            raise QueueFull("queue is full")
+        if (mine or 0) >= per_user:
+            raise QueueFull("too many queued jobs for this user")
+
+    def admit(self, user_id, capacity, per_user):
+        with self._lock:
+            if self._db is not None:
+                self._check(self._db, user_id, capacity, per_user)
+
+    def enqueue(self, job_id, user_id, capacity, per_user, priority):
+        # Admission and pending -> queued in one transaction, so no worker sees
+        # the row before its priority is set or after it was refused
+        return self._wait(self._write(self._enqueue, job_id, user_id, capacity, per_user, priority))
+
+    def _enqueue(self, db, job_id, user_id, capacity, per_user, priority):
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            self._check(db, user_id, capacity, per_user)
+            db.execute(
+                "UPDATE jobs SET state = ?, priority = ?, updated_at = ? WHERE id = ? AND state = ?",
+                (QUEUED, priority, time.time(), job_id, PENDING),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def queued(self):
+        cur = self._exec("SELECT COUNT(*) FROM jobs WHERE state = ?", (QUEUED,))
+        return cur.fetchone()[0] if cur is not None else 0
+
+    def results(self):
+        # Finished jobs a worker ran that the frontend hasn't answered for yet
+        return self._wait(self._write(self._results), [])
+
+    def _results(self, db):
+        rows = db.execute(
+            "SELECT id, chat_id, url, status_id, user_id, media_type, url_key, outcome, result FROM jobs "
+            "WHERE state = ? AND worker IS NOT NULL AND reported = 0 ORDER BY id",
+            (DONE,),
+        ).fetchall()
+        if rows:
+            db.execute(f"UPDATE jobs SET reported = 1 WHERE id IN ({','.join('?' * len(rows))})", [r[0] for r in rows])
+        return rows
+
+    def release_joined(self):
+        # Ride-alongs whose leader was answered by a frontend that is gone, and
+        # rows it accepted but died before queueing: run them as jobs
+        return self._wait(self._execute("UPDATE jobs SET state = ? WHERE state IN (?, ?)", (QUEUED, JOINED, PENDING)), 0)
+
+    # ===== Worker side =====
+    def claim(self, worker, lease, per_user_inflight):
+        # Oldest job of the best priority whose user isn't at the in-flight limit
+        row = self._wait(self._write(self._claim, worker, lease, per_user_inflight))
+        return JournalEntry(*row) if row is not None else None
+
+    def _claim(self, db, worker, lease, per_user_inflight):
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                f"SELECT {', '.join(FIELDS)} FROM jobs WHERE state = ? AND user_id NOT IN ("
+                f"  SELECT user_id FROM jobs WHERE state IN ({','.join('?' * len(ACTIVE))}) GROUP BY user_id HAVING COUNT(*) >= ?"
+                ") ORDER BY priority, id LIMIT 1",
+                (QUEUED, *ACTIVE, per_user_inflight),
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                    (CLAIMED, worker, now + lease, now, row[0]),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return row
+
+    def heartbeat(self, worker, lease, busy, capacity):
+        now = time.time()
+        self._execute(
+            "INSERT INTO workers (name, started_at, heartbeat_at, busy, capacity) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET heartbeat_at=excluded.heartbeat_at, busy=excluded.busy, capacity=excluded.capacity",
+            (worker, now, now, busy, capacity),
+        )
+        self._execute(
+            f"UPDATE jobs SET lease_until = ? WHERE worker = ? AND state IN ({','.join('?' * len(ACTIVE))})",
+            (now + lease, worker, *ACTIVE),
+        )
+
+    def release(self, worker):
+        # Clean shutdown: hand unfinished jobs straight back instead of waiting out the lease
+        released = self._execute(
+            f"UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL WHERE worker = ? AND state IN ({','.join('?' * len(ACTIVE))})",
+            (QUEUED, worker, *ACTIVE),
+        )
+        self._execute("DELETE FROM workers WHERE name = ?", (worker,))
+        return self._wait(released, 0)
+
+    # ===== Either side =====
+    def expire(self, max_attempts):
+        # Redeliver jobs whose worker stopped heartbeating; give up on ones that keep losing workers
+        redelivered = self._wait(self._write(self._expire, max_attempts), 0)
+        self.resumed += redelivered
+        return redelivered
+
+    def _expire(self, db, max_attempts):
+        now = time.time()
+        active = ",".join("?" * len(ACTIVE))
+        db.execute(
+            f"UPDATE jobs SET state = ?, outcome = 'abandoned', updated_at = ? "
+            f"WHERE state IN ({active}) AND lease_until < ? AND attempts + 1 >= ?",
+            (DONE, now, *ACTIVE, now, max_attempts),
+        )
+        return db.execute(
+            f"UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, attempts = attempts + 1, updated_at = ? "
+            f"WHERE state IN ({active}) AND lease_until < ?",
+            (QUEUED, now, *ACTIVE, now),
+        ).rowcount
+
+    def fleet(self, stale_after):
+        cur = self._exec("SELECT name, busy, capacity FROM workers WHERE heartbeat_at >= ?", (time.time() - stale_after,))
+        return cur.fetchall() if cur is not None else []
+
+
+# FairScheduler's interface over the broker, so download_worker and the
+# handlers don't care which role the process runs in. Jobs are the journal
+# rows themselves: add() writes them pending and submit() queues them.
+class BrokerQueue:
+    def __init__(self, broker, worker, capacity, per_user_queued, per_user_inflight, lease, on_claim=None, poll_max=2.0):
+        self.broker = broker
+        self.worker = worker
+        self.capacity = capacity
+        self.per_user_queued = per_user_queued
+        self.per_user_inflight = per_user_inflight
+        self.lease = lease
+        self.on_claim = on_claim  # (entry) -> None, e.g. adopt its scratch dir
+        self.poll_max = poll_max
+        self.submitted = 0
+        self.rejected = 0
+
+    def qsize(self):
+        return self.broker.queued()
+
+    def full(self):
+        return self.qsize() >= self.capacity
+
+    def admit(self, user_id):
+        try:
+            self.broker.admit(user_id, self.capacity, self.per_user_queued)
+        except QueueFull:
+            self.rejected += 1
+            raise
+
+    def next_position(self, user_id, priority=PRIO_NORMAL):
+        return self.qsize() + 1
+
+    def submit(self, user_id, job, priority=PRIO_NORMAL):
+        try:
+            self.broker.enqueue(job[-1], user_id, self.capacity, self.per_user_queued, priority)
+        except QueueFull:
+            self.rejected += 1
+            raise
+        self.submitted += 1
+        return self.qsize()
+
+    async def put(self, user_id, job, priority=PRIO_NORMAL):
+        # The enqueue transaction may wait on other processes' locks: not on the loop
+        return await asyncio.to_thread(self.submit, user_id, job, priority)
+
+    async def get(self):
+        delay = 0.1
+        while True:
+            e = await asyncio.to_thread(self.broker.claim, self.worker, self.lease, self.per_user_inflight)
+            if e is not None:
+                if self.on_claim:
+                    self.on_claim(e)
+                # Same tuple the handlers put on a FairScheduler
+                return e.user_id, (e.chat_id, e.url, e.platform, e.status_id, e.user_id, e.media_type, e.reply_to, e.url_key, e.created_at, None, e.id)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_max)
+
+    def done(self, user_id):
+        pass
@@ -0,0 +1,188 @@
+# cookies.py
+
+import os
+import re
+import time
+from collections import deque
+
+# Jar files are found by name: <platform>_cookies.txt, <platform>_cookies_2.txt, ...
+# (a few short prefixes are aliased, e.g. insta_cookies.txt -> instagram).
+JAR_RE = re.compile(r"^([a-z]+)_cookies(?:[_-]?\w+)?\.txt$")
+ALIASES = {"insta": "instagram", "ig": "instagram", "x": "twitter", "fb": "facebook", "tt": "tiktok"}
+
+RATE_LIMIT_MARKS = ("429", "too many requests", "rate limit", "rate-limit", "ratelimit")
+AUTH_MARKS = ("login", "log in", "sign in", "cookies", "private", "authenticat", "403", "forbidden")
+
+
+def classify_error(err):
+    text = str(err or "").lower()
+    if any(m in text for m in RATE_LIMIT_MARKS):
+        return "rate_limited"
+    if any(m in text for m in AUTH_MARKS):
+        return "auth"
+    return "other"
+
+
+class CookieJar:
+    __slots__ = ("path", "name", "platform", "mtime", "uses", "ok", "failed", "rate_limited", "streak", "benched_until")
+
+    def __init__(self, path, platform, mtime):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.platform = platform
+        self.mtime = mtime
+        self.uses = 0
+        self.ok = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.streak = 0          # consecutive failures
+        self.benched_until = 0.0
+
+    def success_rate(self):
+        return self.ok / self.uses if self.uses else None
+
+
+# Cookie jars per platform, rotated round-robin. The files are only ever
+# parsed inside the engine processes, and the options carry the file's mtime
+# so a warm YoutubeDL (and its parsed jar) is reused until the file changes.
+# Jars that keep failing or get rate limited are benched for a while, and a
+# short per-platform history of anonymous attempts decides whether a job
+# should start with cookies instead of paying for a failed attempt first.
+class CookiePool:
+    def __init__(self, directory=".", rescan_interval=30, bench_after=3, bench_seconds=600,
+                 rate_limit_bench=1800, history=20, cookie_first_ratio=0.5, min_samples=5, explore_every=10):
+        self.directory = directory
+        self.rescan_interval = rescan_interval
+        self.bench_after = bench_after
+        self.bench_seconds = bench_seconds
+        self.rate_limit_bench = rate_limit_bench
+        self.cookie_first_ratio = cookie_first_ratio
+        self.min_samples = min_samples
+        self.explore_every = explore_every
+        self._history = history
+        self._jars = {}       # platform -> [CookieJar]
+        self._next = {}       # platform -> round-robin index
+        self._anon = {}       # platform -> deque of recent anonymous outcomes (True = ok)
+        self._decisions = {}  # platform -> jobs decided since the last anonymous try
+        self._scanned = 0.0
+        self.reloads = 0
+
+    # ===== Discovery / hot reload =====
+    def scan(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._scanned < self.rescan_interval:
+            return
+        self._scanned = now
+        found = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            m = JAR_RE.match(entry.name)
+            if not m or not entry.is_file():
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            found[entry.path] = (ALIASES.get(m.group(1), m.group(1)), mtime)
+
+        jars = {}
+        known = {j.path: j for js in self._jars.values() for j in js}
+        for path, (platform, mtime) in sorted(found.items()):
+            jar = known.get(path)
+            if jar is None:
+                jar = CookieJar(path, platform, mtime)
+            elif jar.mtime != mtime:
+                # New export: new cache key for the engine, clean slate for health
+                jar.mtime = mtime
+                jar.streak = 0
+                jar.benched_until = 0.0
+                self.reloads += 1
+                print(f"Cookie jar reloaded: {jar.name}")
+            jars.setdefault(platform, []).append(jar)
+        self._jars = jars
+
+    # ===== Selection =====
+    def pick(self, platform, exclude=None):
+        self.scan()
+        jars = self._jars.get(platform) or []
+        now = time.monotonic()
+        usable = [j for j in jars if j.benched_until <= now and j is not exclude]
+        if not usable:
+            return None
+        i = self._next.get(platform, 0) % len(usable)
+        self._next[platform] = i + 1
+        return usable[i]
+
+    def wants_cookies(self, platform):
+        # Cookies first while most recent anonymous attempts failed, with an
+        # occasional anonymous try so a recovery is noticed
+        recent = self._anon.get(platform)
+        if not recent or len(recent) < self.min_samples:
+            return False
+        failure = 1 - sum(recent) / len(recent)
+        if failure < self.cookie_first_ratio:
+            return False
+        n = self._decisions.get(platform, 0) + 1
+        if n >= self.explore_every:
+            self._decisions[platform] = 0
+            return False
+        self._decisions[platform] = n
+        return True
+
+    def choose(self, platform):
+        # Jar to start a job with, or None for an anonymous first attempt
+        return self.pick(platform) if self.wants_cookies(platform) else None
+
+    @staticmethod
+    def options(jar):
+        if jar is None:
+            return {}
+        # _cookie_version is ignored by yt-dlp but keys the engine's warm instances
+        return {"cookiefile": jar.path, "_cookie_version": jar.mtime}
+
+    # ===== Health =====
+    def report(self, platform, jar, ok, err=None):
+        kind = None if ok else classify_error(err)
+        if jar is None:
+            if ok or kind in ("auth", "rate_limited"):
+                # Only outcomes cookies could change count against anonymous access
+                self._anon.setdefault(platform, deque(maxlen=self._history)).append(ok)
+            return kind
+        jar.uses += 1
+        if ok:
+            jar.ok += 1
+            jar.streak = 0
+            return kind
+        jar.failed += 1
+        jar.streak += 1
+        now = time.monotonic()
+        if kind == "rate_limited":
+            jar.rate_limited += 1
+            jar.benched_until = now + self.rate_limit_bench
+            print(f"Cookie jar {jar.name} rate limited, benched for {self.rate_limit_bench}s")
+        elif jar.streak >= self.bench_after:
+            # Back off harder on each extra failure in a row
+            wait = self.bench_seconds * 2 ** min(jar.streak - self.bench_after, 4)
+            jar.benched_until = now + wait
+            print(f"Cookie jar {jar.name} failing ({jar.streak} in a row), benched for {wait}s")
+        return kind
+
+    def stats(self):
+        now = time.monotonic()
+        out = {}
+        for platform, jars in self._jars.items():
+            recent = self._anon.get(platform) or ()
+            out[platform] = {
+                "anon_failure": (1 - sum(recent) / len(recent)) if recent else None,
+                "jars": [{
+                    "name": j.name,
+                    "uses": j.uses,
+                    "success_rate": j.success_rate(),
+                    "rate_limited": j.rate_limited,
+                    "benched_for": max(0, j.benched_until - now),
+                } for j in jars],
+            }
+        return out
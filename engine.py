@@ -0,0 +1,313 @@
+# engine.py
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import subprocess
+from collections import OrderedDict
+from multiprocessing.connection import Connection
+
+# Children are fresh interpreters running this file (fork + exec), not forks of
+# the bot: by the time the pool starts, the parent has threads (journal writer,
+# loop watchdog) and open sockets that a bare fork would copy mid-state. This
+# module imports only the stdlib, so nothing of main.py runs in a child, and
+# close_fds keeps the parent's sockets and the other children's pipes out.
+CHILD_ENTRY = os.path.abspath(__file__)
+MAX_YDL_PER_PROC = 16  # platform x media type x cookie jar
+# Platform -> the yt-dlp extractor that handles its post URLs. Jobs go straight
+# to it instead of testing the URL against every registered extractor; URLs it
+# doesn't claim (stories, short links, mirrors) take the generic path.
+IE_KEYS = {
+    "instagram": "Instagram",
+    "twitter": "Twitter",
+    "tiktok": "TikTok",
+    "facebook": "Facebook",
+}
+
+
+class ExtractError(Exception):
+    pass
+
+class ExtractTimeout(ExtractError):
+    pass
+
+class EngineCrash(ExtractError):
+    pass
+
+
+PER_JOB_OPTS = ("outtmpl", "format")  # applied to a reused YoutubeDL instead of keying it
+
+def _ydl_key(platform, opts):
+    rest = {k: v for k, v in opts.items() if k not in PER_JOB_OPTS}
+    return platform, json.dumps(rest, sort_keys=True, default=str)
+
+def _child_main(conn):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    started = time.monotonic()
+    import yt_dlp
+    conn.send(("ready", None, {"import": time.monotonic() - started}))  # warm before the first job
+    ydls = OrderedDict()  # (platform, opts) -> warm YoutubeDL
+    ies = {}  # platform -> pinned extractor class, None if unavailable
+    job = {}  # per-job stage marks filled in by the yt-dlp hooks below
+
+    def pinned_ie(ydl, platform, url):
+        if platform not in ies:
+            try:
+                ies[platform] = type(ydl.get_info_extractor(IE_KEYS[platform])) if platform in IE_KEYS else None
+            except Exception:
+                ies[platform] = None  # renamed/removed in this yt-dlp version
+        ie = ies[platform]
+        return ie.ie_key() if ie is not None and ie.suitable(url) else None
+
+    def on_progress(d):
+        if d.get("status") == "finished":
+            job["download_end"] = time.monotonic()
+            job["bytes"] = job.get("bytes", 0) + (d.get("total_bytes") or d.get("downloaded_bytes") or 0)
+
+    def on_postprocess(d):
+        if d.get("status") == "started":
+            job.setdefault("pp_start", time.monotonic())
+        elif d.get("status") == "finished":
+            job["pp_end"] = time.monotonic()
+
+    while True:
+        try:
+            platform, opts, url, download, probed = conn.recv()
+        except (EOFError, OSError):
+            break
+        job.clear()
+        job["start"] = time.monotonic()
+        try:
+            key = _ydl_key(platform, opts)
+            ydl = ydls.get(key)
+            if ydl is None:
+                ydl = yt_dlp.YoutubeDL(dict(opts))
+                ydl.add_progress_hook(on_progress)
+                ydl.add_postprocessor_hook(on_postprocess)
+                ydls[key] = ydl
+                while len(ydls) > MAX_YDL_PER_PROC:
+                    old = ydls.popitem(last=False)[1]
+                    old.params["cookiefile"] = None  # close() would write the jar back to a shared file
+                    old.close()
+            else:
+                ydls.move_to_end(key)
+                if "outtmpl" in opts:
+                    ydl.params["outtmpl"]["default"] = opts["outtmpl"]
+                fmt = opts.get("format")
+                if fmt and fmt != ydl.params.get("format"):
+                    ydl.params["format"] = fmt
+                    ydl.format_selector = ydl.build_format_selector(fmt)
+            if probed is not None:
+                # Second phase of a probe-then-download job: skip re-extraction
+                info = ydl.process_ie_result(probed, download=download)
+            else:
+                ie_key = pinned_ie(ydl, platform, url)
+                job["dispatch"] = "pinned" if ie_key else "generic"
+                info = ydl.extract_info(url, download=download, ie_key=ie_key)
+            conn.send(("ok", ydl.sanitize_info(info) if info else None, _timings(job)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}", _timings(job)))
+
+def _timings(job):
+    end = time.monotonic()
+    t = {"total": end - job["start"], "bytes": job.get("bytes", 0)}
+    if "dispatch" in job:
+        t["dispatch"] = job["dispatch"]
+    if "download_end" in job:
+        t["download"] = job["download_end"] - job["start"]
+    if "pp_start" in job:
+        t["postprocess"] = job.get("pp_end", end) - job["pp_start"]
+    return t
+
+
+class _Slot:
+    def __init__(self, idx):
+        self.idx = idx
+        self.proc = None
+        self.conn = None
+        self.ready = False
+        self.jobs = 0
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        parent_sock, child_sock = socket.socketpair()
+        with child_sock:
+            fd = child_sock.fileno()
+            self.proc = subprocess.Popen([sys.executable, CHILD_ENTRY, str(fd)], pass_fds=(fd,), stdin=subprocess.DEVNULL)
+        self.conn = Connection(parent_sock.detach())  # a dead child is EOF here
+        self.ready = False
+        self.jobs = 0
+
+    def kill(self):
+        try:
+            if self.proc is not None and self.proc.poll() is None:
+                self.proc.kill()
+                self.proc.wait(1)
+        except Exception:
+            pass
+        try:
+            if self.conn is not None:
+                self.conn.close()
+        except Exception:
+            pass
+        self.proc = None
+        self.conn = None
+
+
+# Pool of warm yt-dlp processes. Each slot runs one job at a time; a job that
+# overruns its timeout (or is cancelled) gets its process killed and replaced,
+# so a hung extractor never blocks the bot's event loop. No process starts
+# until start(): call it in the background to pre-warm, or let the first job
+# do it.
+class ExtractEngine:
+    def __init__(self, size, job_timeout):
+        self.size = size
+        self.job_timeout = job_timeout
+        self._slots = []
+        self._idle = None
+        self._starting = None
+        self.warm = False
+        self.import_seconds = None
+        self.start_seconds = None
+        self.dispatch = {"pinned": 0, "generic": 0}
+        self.jobs = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.restarts = 0
+        self.busy = 0
+
+    def _restart(self, slot):
+        slot.kill()
+        slot.start()
+        self.restarts += 1
+
+    async def _boot(self, slot):
+        # A new child imports yt_dlp, then says so; -> seconds it took
+        status, _, timings = await self._recv(slot)
+        if status != "ready":
+            raise EngineCrash(f"engine process sent {status!r} before it was ready")
+        slot.ready = True
+        return timings["import"]
+
+    async def start(self):
+        # Idempotent: the first caller starts the processes, everyone else waits for it
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        try:
+            await asyncio.shield(self._starting)
+        except Exception:
+            self._starting = None  # let the next caller try again
+            raise
+
+    async def _start(self):
+        started = time.monotonic()
+        slots = [_Slot(i) for i in range(self.size)]
+        try:
+            for slot in slots:
+                slot.start()
+            # The children import yt_dlp in parallel, each in its own process
+            imports = await asyncio.gather(*(self._boot(slot) for slot in slots))
+        except BaseException:
+            for slot in slots:
+                slot.kill()
+            raise
+        self.import_seconds = max(imports, default=0.0)
+        self._slots = slots
+        self._idle = asyncio.Queue()
+        for slot in slots:
+            self._idle.put_nowait(slot)
+        self.start_seconds = time.monotonic() - started
+        self.warm = True
+        print(f"[*] Extraction engine started with {self.size} processes in {self.start_seconds:.1f}s (yt_dlp import {self.import_seconds:.1f}s)")
+
+    async def close(self):
+        if self._starting is not None and not self._starting.done():
+            self._starting.cancel()
+        for slot in self._slots:
+            slot.kill()
+        self._slots = []
+
+    async def _recv(self, slot):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = slot.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+        return slot.conn.recv()
+
+    async def run(self, platform, opts, url, download=True, timeout=None, info=None):
+        info, _ = await self.run_timed(platform, opts, url, download, timeout, info)
+        return info
+
+    async def run_timed(self, platform, opts, url, download=True, timeout=None, info=None):
+        # Returns (info, timings); timings has total/download/postprocess seconds, bytes
+        # and, for extractions, whether the platform's extractor was pinned
+        if not self.warm:
+            await self.start()
+        slot = await self._idle.get()
+        self.busy += 1
+        self.jobs += 1
+        started = time.monotonic()
+        try:
+            if not slot.alive():
+                self._restart(slot)
+            if not slot.ready:
+                await asyncio.wait_for(self._boot(slot), timeout or self.job_timeout)
+            slot.conn.send((platform, opts, url, download, info))
+            slot.jobs += 1
+            status, payload, timings = await asyncio.wait_for(self._recv(slot), timeout or self.job_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._restart(slot)
+            raise ExtractTimeout(f"{platform} job timed out after {time.monotonic() - started:.0f}s")
+        except asyncio.CancelledError:
+            self._restart(slot)
+            raise
+        except (EOFError, OSError) as e:
+            self.crashes += 1
+            self._restart(slot)
+            raise EngineCrash(f"engine process crashed: {e}")
+        finally:
+            self.busy -= 1
+            self._idle.put_nowait(slot)
+
+        if "dispatch" in timings:
+            self.dispatch[timings["dispatch"]] += 1
+        if status == "error":
+            self.errors += 1
+            raise ExtractError(payload)
+        return payload, timings
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "alive": sum(1 for s in self._slots if s.alive()),
+            "busy": self.busy,
+            "jobs": self.jobs,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+            "restarts": self.restarts,
+            "warm": self.warm,
+            "import_seconds": self.import_seconds,
+            "start_seconds": self.start_seconds,
+            "pinned": self.dispatch["pinned"],
+            "generic": self.dispatch["generic"],
+        }
+
+
+if __name__ == "__main__":
+    # Child entry: python engine.py <fd>, started by _Slot.start()
+    _child_main(Connection(int(sys.argv[1])))
@@ -0,0 +1,160 @@
+# formats.py
+
+# Format downselection on a probed (download=False) yt-dlp info dict, so the
+# send limit is enforced before any media bytes are fetched.
+
+FITS = "fits"
+TOO_LARGE = "too_large"
+UNKNOWN = "unknown"
+
+
+# format_sort names codecs the way yt-dlp does; format dicts carry the RFC 6381 ids
+CODEC_ALIASES = {
+    "h264": ("avc1", "avc3", "h264"),
+    "h265": ("hvc1", "hev1", "h265", "hevc"),
+    "aac": ("mp4a", "aac"),
+}
+
+
+def format_size(f, duration=None):
+    size = f.get("filesize") or f.get("filesize_approx")
+    if not size and f.get("tbr") and duration:
+        size = f["tbr"] * 1000 / 8 * duration  # tbr is in kbit/s
+    return int(size) if size else None
+
+def _has_video(f):
+    return f.get("vcodec") != "none"
+
+def _has_audio(f):
+    return f.get("acodec") != "none"
+
+def _quality(f):
+    return (f.get("height") or 0, f.get("tbr") or f.get("abr") or 0, f.get("filesize") or 0)
+
+def _codec_is(codec, name):
+    return (codec or "").lower().startswith(CODEC_ALIASES.get(name, (name,)))
+
+def _rank(video, audio, sort):
+    # Preference tuple for the subset of yt-dlp's format_sort the profiles use:
+    # vcodec:X, acodec:X, ext:V[:A] and res:N (N and below first)
+    key = []
+    for item in sort or ():
+        field, _, pref = item.partition(":")
+        if field == "vcodec":
+            key.append(_codec_is(video.get("vcodec"), pref))
+        elif field == "acodec":
+            key.append(_codec_is(audio.get("acodec"), pref))
+        elif field == "ext":
+            v_ext, _, a_ext = pref.partition(":")
+            key.append(video.get("ext") == v_ext and (audio is video or audio.get("ext") == (a_ext or v_ext)))
+        elif field == "res" and pref.isdigit():
+            key.append((video.get("height") or 0) <= int(pref))
+    return tuple(key)
+
+def _formats(info):
+    fmts = info.get("formats") or []
+    if not fmts and info.get("url"):
+        fmts = [info]
+    return [f for f in fmts if f.get("format_id") and f.get("url")]
+
+def _pick(candidates, limit_bytes):
+    # candidates: [(quality, spec, size, rank)]; returns the best one that fits
+    known = [c for c in candidates if c[2] is not None]
+    if not known:
+        return UNKNOWN, None, None
+    fitting = [c for c in known if c[2] <= limit_bytes]
+    if not fitting:
+        return TOO_LARGE, None, min(c[2] for c in known)
+    best = max(fitting, key=lambda c: (c[3], c[0]))
+    return FITS, best[1], best[2]
+
+def _candidates(info, media_type, can_merge, limit_bytes=None, sort=None):
+    # -> [(quality, spec, size, rank)]; quality[0] is height for video, bitrate
+    # for audio, rank the format_sort preferences (ahead of quality). With
+    # limit_bytes each video gets the best audio that still fits beside it.
+    if not isinstance(info, dict) or info.get("_type") in ("playlist", "multi_video"):
+        return []
+    duration = info.get("duration")
+    fmts = _formats(info)
+    candidates = []
+    if media_type == "audio":
+        audio_only = [f for f in fmts if _has_audio(f) and not _has_video(f)]
+        pool = audio_only or [f for f in fmts if _has_audio(f)]
+        for f in pool:
+            q = (f.get("abr") or f.get("tbr") or 0, f.get("asr") or 0)
+            if not audio_only:
+                # Audio comes out of a muxed file: smaller source is just as good
+                q = (q[0], -(format_size(f, duration) or 0))
+            candidates.append((q, f["format_id"], format_size(f, duration), ()))
+        return candidates
+
+    for f in fmts:
+        if _has_video(f) and _has_audio(f):
+            candidates.append((_quality(f), f["format_id"], format_size(f, duration), _rank(f, f, sort)))
+
+    if can_merge:
+        audios = [f for f in fmts if _has_audio(f) and not _has_video(f)]
+        videos = [f for f in fmts if _has_video(f) and not _has_audio(f)]
+        sized_audio = [(format_size(a, duration), a) for a in audios]
+        sized_audio = [(s, a) for s, a in sized_audio if s is not None]
+        if sized_audio:
+            # Smallest decent audio leaves the most room for video
+            smallest = min(sized_audio, key=lambda sa: (sa[0], -(sa[1].get("abr") or 0)))
+            for v in videos:
+                v_size = format_size(v, duration)
+                a_size, audio = smallest
+                if v_size is not None and limit_bytes:
+                    fitting = [sa for sa in sized_audio if v_size + sa[0] <= limit_bytes]
+                    if fitting:
+                        a_size, audio = max(fitting, key=lambda sa: (_rank(v, sa[1], sort), sa[1].get("abr") or sa[1].get("tbr") or 0, -sa[0]))
+                size = v_size + a_size if v_size is not None else None
+                candidates.append((_quality(v), f"{v['format_id']}+{audio['format_id']}", size, _rank(v, audio, sort)))
+    return candidates
+
+def pick_format(info, media_type, limit_bytes, can_merge=True, sort=None):
+    """Return (verdict, format_spec, estimated_bytes) for a probed info dict.
+
+    sort is the profile's yt-dlp format_sort: among formats that fit, its
+    codec/container/resolution preferences decide before height and bitrate.
+
+    verdict is FITS (download format_spec), TOO_LARGE (every format with a
+    known size is over the limit; estimated_bytes is the smallest) or UNKNOWN
+    (no sizes reported, keep the generic format and check after download).
+    """
+    candidates = _candidates(info, media_type, can_merge, limit_bytes, sort)
+    if not candidates:
+        return UNKNOWN, None, None
+    return _pick(candidates, limit_bytes)
+
+def pick_shrink_source(info, media_type, floor, max_bytes, can_merge=True):
+    """Return (format_spec, estimated_bytes) of the source to re-encode, or None.
+
+    The smallest format at or above floor (target height for video, target
+    bitrate for audio) loses nothing to the re-encode; when none reaches it,
+    the best one there is. Formats over max_bytes are not worth fetching.
+    """
+    known = [c for c in _candidates(info, media_type, can_merge) if c[2] is not None and c[2] <= max_bytes]
+    if not known:
+        return None
+    above = [c for c in known if c[0][0] >= (floor or 0)]
+    best = min(above, key=lambda c: c[2]) if above else max(known, key=lambda c: c[0])
+    return best[1], best[2]
+
+def stream_format(info, spec, max_bytes):
+    """Return the format dict for spec when it can be piped straight to Telegram.
+
+    That is one progressive mp4 file with both video and audio, fetched over
+    plain HTTP(S) with no cookies, and known to be at most max_bytes. Merged
+    specs, HLS/DASH fragments and anything sizeless return None.
+    """
+    if not spec or "+" in spec or not isinstance(info, dict):
+        return None
+    f = next((f for f in _formats(info) if f["format_id"] == spec), None)
+    if f is None or not (_has_video(f) and _has_audio(f)):
+        return None
+    if f.get("ext") != "mp4" or f.get("fragments") or f.get("cookies"):
+        return None
+    if (f.get("protocol") or "https") not in ("http", "https"):
+        return None
+    size = format_size(f)
+    return f if size is not None and size <= max_bytes else None
@@ -0,0 +1,138 @@
+# http_client.py
+
+import asyncio
+import random
+import contextlib
+
+import aiohttp
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT = {"GET", "HEAD", "OPTIONS"}
+
+
+# One pooled aiohttp session for every outbound request the bot makes itself
+# (Telegram file downloads, URL shortening, thumbnails, ...). Connections are
+# kept alive and reused, DNS answers are cached, and idempotent requests are
+# retried with jittered exponential backoff. Other methods (a POST may have
+# landed before the connection dropped) are only retried when the caller
+# passes retries explicitly.
+class HttpClient:
+    def __init__(self, limit=100, limit_per_host=16, dns_ttl=300, connect_timeout=10, read_timeout=60, retries=3, backoff=0.5):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._connector = None
+        self.counters = {
+            "requests": 0,
+            "retries": 0,
+            "errors": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0,
+        }
+
+    def _counter(self, name):
+        async def hook(session, ctx, params):
+            self.counters[name] += 1
+        return hook
+
+    async def start(self):
+        if self._session is not None:
+            return
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._counter("connections_created"))
+        trace.on_connection_reuseconn.append(self._counter("connections_reused"))
+        trace.on_dns_cache_hit.append(self._counter("dns_cache_hits"))
+        trace.on_dns_cache_miss.append(self._counter("dns_cache_misses"))
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=30,
+        )
+        self._session = aiohttp.ClientSession(connector=self._connector, timeout=self.timeout, trace_configs=[trace])
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._connector = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            raise RuntimeError("HttpClient used before start()")
+        return self._session
+
+    async def _delay(self, attempt, resp=None):
+        retry_after = None
+        if resp is not None:
+            try:
+                retry_after = float(resp.headers.get("Retry-After", ""))
+            except ValueError:
+                pass
+        delay = retry_after if retry_after is not None else self.backoff * (2 ** attempt) * (0.5 + random.random())
+        self.counters["retries"] += 1
+        await asyncio.sleep(min(delay, 30))
+
+    async def _send(self, method, url, retries=None, **kwargs):
+        if retries is None:
+            retries = self.retries if method.upper() in IDEMPOTENT else 0
+        attempt = 0
+        while True:
+            self.counters["requests"] += 1
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    self.counters["errors"] += 1
+                    raise
+                await self._delay(attempt)
+                attempt += 1
+                continue
+            if resp.status in RETRY_STATUSES and attempt < retries:
+                resp.release()
+                await self._delay(attempt, resp)
+                attempt += 1
+                continue
+            return resp
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, retries=None, **kwargs):
+        # Retries only cover getting the response; the body is the caller's to read
+        resp = await self._send(method, url, retries, **kwargs)
+        try:
+            yield resp
+        finally:
+            resp.release()
+
+    async def fetch_text(self, url, retries=None, **kwargs):
+        async with self.stream("GET", url, retries, **kwargs) as resp:
+            resp.raise_for_status()
+            return await resp.text()
+
+    async def fetch_bytes(self, url, max_bytes=None, retries=None, **kwargs):
+        async with self.stream("GET", url, retries, **kwargs) as resp:
+            resp.raise_for_status()
+            if max_bytes and (resp.content_length or 0) > max_bytes:
+                raise ValueError(f"response larger than {max_bytes} bytes")
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                data += chunk
+                if max_bytes and len(data) > max_bytes:
+                    raise ValueError(f"response larger than {max_bytes} bytes")
+            return bytes(data)
+
+    def stats(self):
+        s = dict(self.counters)
+        opened = s["connections_created"] + s["connections_reused"]
+        s["reuse_ratio"] = (s["connections_reused"] / opened) if opened else 0.0
+        s["limit"] = self.limit
+        s["limit_per_host"] = self.limit_per_host
+        return s
@@ -0,0 +1,194 @@
+# journal.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    status_id INTEGER,
+    user_id INTEGER NOT NULL,
+    media_type TEXT NOT NULL,
+    reply_to INTEGER,
+    batch INTEGER NOT NULL DEFAULT 0,
+    job_dir TEXT,
+    format TEXT,
+    reserved INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    outcome TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+# Added after the first release; open() adds them to older databases
+COLUMNS = {
+    "priority": "INTEGER NOT NULL DEFAULT 1",
+    "url_key": "TEXT",
+    "worker": "TEXT",        # broker: process holding the job
+    "lease_until": "REAL",   # broker: redelivered when this passes without a heartbeat
+    "result": "TEXT",        # JSON the frontend needs to answer ride-along users
+    "reported": "INTEGER NOT NULL DEFAULT 0",
+}
+
+PENDING = "pending"  # written, not yet admitted: no worker may claim it
+QUEUED = "queued"
+JOINED = "joined"  # waits on another job for the same link
+EXTRACTING = "extracting"
+DOWNLOADING = "downloading"
+UPLOADING = "uploading"
+DONE = "done"
+FIELDS = ("id", "state", "chat_id", "url", "platform", "status_id", "user_id", "media_type",
+          "reply_to", "batch", "job_dir", "format", "reserved", "attempts", "priority", "url_key",
+          "outcome", "result", "created_at")
+UPDATABLE = {"status_id", "batch", "job_dir", "format", "reserved", "priority"}
+
+
+def _report(future):
+    # Nobody waits on most writes: make their failures visible
+    if not future.cancelled() and future.exception() is not None:
+        print("journal write error:", future.exception())
+
+
+class JournalEntry:
+    __slots__ = FIELDS
+
+    def __init__(self, *values):
+        for name, value in zip(FIELDS, values):
+            setattr(self, name, value)
+
+
+# SQLite (WAL) record of every download job and the stage it reached
+# (queued -> extracting -> downloading -> uploading -> done). Rows that never
+# reach done were cut off by a restart and are picked up again on startup;
+# a downloading row remembers its scratch dir and format so yt-dlp can
+# continue the .part files instead of starting over. Writes are blocking
+# sqlite calls (a write() and a file lock each), so they never run on the
+# event loop: a single writer thread with its own connection applies them in
+# order, and add() hands out the row id up front instead of waiting for the
+# insert. Reads stay on the loop; in WAL mode they don't wait on writers.
+class JobJournal:
+    def __init__(self, path):
+        self.path = path
+        self._db = None   # reads, on the event loop
+        self._lock = threading.Lock()
+        self._wdb = None  # writes, only ever used on the writer thread
+        self._writer = None
+        self._last_id = 0
+        self.resumed = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = self._connect()
+        self._db.executescript(SCHEMA)
+        known = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for name, decl in COLUMNS.items():
+            if name not in known:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+        self._wdb = self._connect()
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="journal")
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)  # pending writes land before the connections close
+            self._writer = None
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._wdb.close()
+                self._db = self._wdb = None
+
+    def _exec(self, sql, args=()):
+        with self._lock:
+            if self._db is None:
+                return None
+            return self._db.execute(sql, args)
+
+    def _write(self, fn, *args):
+        # fn(write_connection, *args) on the writer thread -> concurrent Future
+        if self._writer is None:
+            return None
+        return self._writer.submit(fn, self._wdb, *args)
+
+    def _execute(self, sql, args=()):
+        future = self._write(lambda db: db.execute(sql, args).rowcount)
+        if future is not None:
+            future.add_done_callback(_report)
+        return future
+
+    def _new_id(self):
+        # Microseconds, then 8 bits of pid so two processes adding at once
+        # don't collide; ids keep the order jobs were created in
+        job_id = (time.time_ns() // 1000) << 8 | (os.getpid() & 0xFF)
+        if job_id <= self._last_id:
+            job_id = self._last_id + 256
+        self._last_id = job_id
+        return job_id
+
+    def add(self, chat_id, url, platform, status_id, user_id, media_type, reply_to, batch=False, url_key=None, state=QUEUED):
+        if self._writer is None:
+            return None
+        job_id, now = self._new_id(), time.time()
+        self._execute(
+            "INSERT INTO jobs (id, state, chat_id, url, platform, status_id, user_id, media_type, reply_to, batch, url_key, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, state, chat_id, url, platform, status_id, user_id, media_type, reply_to, int(batch), url_key, now, now),
+        )
+        return job_id
+
+    def mark(self, job_id, state=None, **fields):
+        if job_id is None:
+            return
+        sets, args = ["updated_at = ?"], [time.time()]
+        if state is not None:
+            sets.append("state = ?")
+            args.append(state)
+        for name, value in fields.items():
+            if name not in UPDATABLE:
+                raise ValueError(f"unknown journal field {name}")
+            sets.append(f"{name} = ?")
+            args.append(value)
+        self._execute(f"UPDATE jobs SET {', '.join(sets)} WHERE id = ?", (*args, job_id))
+
+    def finish(self, job_id, outcome, result=None):
+        if job_id is None:
+            return
+        self._execute(
+            "UPDATE jobs SET state = ?, outcome = ?, result = ?, updated_at = ? WHERE id = ? AND state != ?",
+            (DONE, outcome, result and json.dumps(result), time.time(), job_id, DONE),
+        )
+
+    def unfinished(self):
+        cur = self._exec(f"SELECT {', '.join(FIELDS)} FROM jobs WHERE state != ? ORDER BY id", (DONE,))
+        return [JournalEntry(*row) for row in cur] if cur is not None else []
+
+    def live_dirs(self):
+        # Scratch dirs of jobs not done yet, possibly running in another process
+        cur = self._exec("SELECT job_dir FROM jobs WHERE state != ? AND job_dir IS NOT NULL", (DONE,))
+        return {row[0] for row in cur} if cur is not None else set()
+
+    def requeue(self, job_id):
+        # Back to the queue after a restart; attempts counts restarts the job lived through
+        self._execute("UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?", (QUEUED, time.time(), job_id))
+        self.resumed += 1
+
+    def prune(self, older_than):
+        self._execute("DELETE FROM jobs WHERE state = ? AND updated_at < ?", (DONE, time.time() - older_than))
+
+    def counts(self):
+        cur = self._exec("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        return dict(cur.fetchall()) if cur is not None else {}
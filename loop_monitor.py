@@ -0,0 +1,156 @@
+# loop_monitor.py
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+
+from metrics import REGISTRY
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_STACK_FRAMES = 30
+LOOP_LAG = REGISTRY.histogram("tb_loop_lag_seconds", "Event loop scheduling delay of a periodic timer", buckets=LAG_BUCKETS)
+LOOP_STALLS = REGISTRY.counter("tb_loop_stalls_total", "Times the event loop was blocked past the watchdog threshold")
+SLOW_CALLBACKS = REGISTRY.counter("tb_loop_slow_callbacks_total", "Callbacks asyncio debug mode reported as slow")
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class _SlowCallbackLog(logging.Handler):
+    # asyncio reports "Executing <Handle ...> took 0.412 seconds" through its logger in debug mode
+    def __init__(self, monitor):
+        super().__init__(logging.WARNING)
+        self.monitor = monitor
+
+    def emit(self, record):
+        msg = record.getMessage()
+        if msg.startswith("Executing "):
+            SLOW_CALLBACKS.inc()
+            self.monitor.slow_callbacks.append((time.time(), msg[:500]))
+            print("Slow callback:", msg[:300])
+
+
+# Watches the bot's own event loop. A sampler task sleeps for a fixed tick
+# and records how late it woke up (the lag every other coroutine saw too).
+# A daemon thread checks the sampler's heartbeat; when the loop has been
+# stuck longer than the threshold it grabs the loop thread's stack while the
+# blocking code is still on it, so the culprit is named, not guessed. With
+# slow_callback set, asyncio debug mode also logs each callback that ran
+# longer than that.
+class LoopMonitor:
+    def __init__(self, threshold=0.5, tick=0.1, slow_callback=None, keep=20, window=3000):
+        self.threshold = threshold
+        self.tick = tick
+        self.slow_callback = slow_callback  # seconds, None = debug mode off
+        self._loop = None
+        self._loop_thread = None
+        self._beat = time.monotonic()
+        self._stall = None  # the stall in progress, while the watchdog sees one
+        self._stop = threading.Event()
+        self._lags = deque(maxlen=window)  # recent samples for the summary
+        self.stalls = deque(maxlen=keep)
+        self.slow_callbacks = deque(maxlen=keep)
+        self.stall_count = 0
+        self.max_lag = 0.0
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        if self.slow_callback:
+            self._loop.slow_callback_duration = self.slow_callback
+            self._loop.set_debug(True)
+            logging.getLogger("asyncio").addHandler(_SlowCallbackLog(self))
+        asyncio.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        print(f"[*] Loop monitor: stalls over {self.threshold:.2f}s are traced" + (f", callbacks over {self.slow_callback:.2f}s logged" if self.slow_callback else ""))
+
+    def stop(self):
+        self._stop.set()
+
+    async def _sample(self):
+        while not self._stop.is_set():
+            expected = time.monotonic() + self.tick
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._beat = now
+            LOOP_LAG.observe(lag)
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    # ===== Watchdog thread =====
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            blocked = time.monotonic() - self._beat - self.tick
+            if blocked > self.threshold:
+                if self._stall is None:
+                    self._stall = self._capture(blocked)
+                else:
+                    self._stall["blocked"] = round(blocked, 3)
+            elif self._stall is not None:
+                stall, self._stall = self._stall, None
+                print(f"Event loop was blocked for {stall['blocked']:.2f}s in {stall['task']}:\n{stall['where']}")
+
+    def _capture(self, blocked):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame, limit=-MAX_STACK_FRAMES) if frame is not None else []
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        stall = {
+            "at": time.time(),
+            "blocked": round(blocked, 3),  # grows while the stall lasts
+            "task": task.get_name() + " " + repr(task.get_coro())[:200] if task is not None else "(callback, no task)",
+            "where": stack[-1].strip() if stack else "?",
+            "stack": "".join(stack),
+        }
+        self.stall_count += 1
+        LOOP_STALLS.inc()
+        self.stalls.append(stall)
+        return stall
+
+    # ===== Reporting =====
+    def summary(self, reset=True):
+        lags = list(self._lags)
+        s = {
+            "samples": len(lags),
+            "lag_p50": round(_percentile(lags, 0.5), 4),
+            "lag_p99": round(_percentile(lags, 0.99), 4),
+            "lag_max": round(max(lags, default=0.0), 4),
+            "stalls": self.stall_count,
+            "slow_callbacks": len(self.slow_callbacks),
+        }
+        if reset:
+            self._lags.clear()
+        return s
+
+    def snapshot(self):
+        return {
+            "threshold": self.threshold,
+            "tick": self.tick,
+            "slow_callback": self.slow_callback,
+            "lag": self.summary(reset=False),
+            "lag_max_ever": round(self.max_lag, 4),
+            "stalling_now": self._stall is not None,
+            "stalls": list(self.stalls),
+            "slow_callbacks": [{"at": at, "message": msg} for at, msg in self.slow_callbacks],
+        }
+
+    async def report_loop(self, interval):
+        # Periodic one-liner; a p99 near the threshold is the early warning
+        while not self._stop.is_set():
+            await asyncio.sleep(interval)
+            s = self.summary()
+            warn = " ⚠️ loop is lagging" if s["lag_p99"] > self.threshold / 2 else ""
+            print(f"Loop: p50 {s['lag_p50'] * 1000:.1f}ms • p99 {s['lag_p99'] * 1000:.1f}ms • max {s['lag_max'] * 1000:.0f}ms • "
+                  f"{s['stalls']} stalls • {s['slow_callbacks']} slow callbacks{warn}")
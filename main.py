@@ -9,137 +9,362 @@ import asyncio
 import shutil
 import hashlib
 import json
+import socket
 import signal
 import atexit
 from datetime import datetime, timezone
 
+BOOT_AT = time.monotonic()  # cold-start phases are measured from here
+
 from dotenv import load_dotenv
-import yt_dlp
-import aiohttp
 from telebot.async_telebot import AsyncTeleBot
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-
-from keep_alive import keep_alive 
-keep_alive() # Flask server for uptime
+from telebot import asyncio_helper
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaVideo, InputMediaAudio, Message
+
+from result_cache import ResultCache
+from storage import UsageStore
+from http_client import HttpClient
+from scheduler import FairScheduler, QueueFull, PRIO_HIGH, PRIO_NORMAL
+from state_store import TTLStore, LinkRecord, FileRecord, BatchRecord
+from tg_governor import TelegramGovernor, INTERACTIVE
+from metrics import REGISTRY
+from engine import ExtractEngine, ExtractError, ExtractTimeout
+from formats import pick_format, pick_shrink_source, stream_format, FITS, TOO_LARGE
+from scratch import ScratchSpace, DiskFull
+from web_server import WebServer
+from batch import Batch, BatchItem
+from profiles import ydl_options, probe_options, profile_id
+from cookies import CookiePool, classify_error
+from audio import AudioEngine, STREAM_CHUNK, HEAD_BYTES, pipeable
+from shrink import Shrinker, Hopeless
+from loop_monitor import LoopMonitor
+from stream_upload import StreamUploader
+from url_router import UrlRouter
+from journal import PENDING, QUEUED, JOINED, EXTRACTING, DOWNLOADING, UPLOADING
+from broker import JobBroker, BrokerQueue
+
+load_dotenv()  # before Config so .env can override the env-tunable values
 
 # ===== Config =====
-USAGE_FILE = "/mnt/data/usage.json"
-INSTA_FILE = "/mnt/data/insta_usage.json"
+DATA_DIR = os.getenv("DATA_DIR", "/mnt/data")
+USAGE_FILE = f"{DATA_DIR}/usage.json"        # legacy, migrated into USAGE_DB once
+INSTA_FILE = f"{DATA_DIR}/insta_usage.json"  # legacy, migrated into USAGE_DB once
+USAGE_DB = f"{DATA_DIR}/usage.db"
+USAGE_FLUSH_DELAY = 2  # seconds to batch usage writes before committing
 URL_TTL_SECONDS = 60 * 60  # 1 hour
 MAX_URL_STORAGE = 2000
-MAX_WORKERS = 12
+MAX_COOLDOWN_ENTRIES = 50000
+MAX_PROBE_CACHE = 500
+SHORT_LINK_TTL = 24 * 3600  # expanded t.co / fb.watch / vm.tiktok.com targets
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", 12))
 TMP_CLEAN_INTERVAL = 3600  # seconds
 COOLDOWN_SECONDS = 3
 MAX_INSTA_PER_DAY = 10
 MAX_SEND_MB = 50
-TMP_DIR = "/tmp"
+TMP_DIR = os.getenv("TMP_DIR", "/tmp")
+SCRATCH_DIR = os.path.join(TMP_DIR, "tbloader")  # per-job dirs live here, nothing else does
+SCRATCH_QUOTA_MB = int(os.getenv("SCRATCH_QUOTA_MB", 0)) or None  # cap on reserved scratch space, unset = free disk only
+SCRATCH_MIN_FREE_MB = int(os.getenv("SCRATCH_MIN_FREE_MB", 512))  # always leave this much free on the TMP_DIR filesystem
+SCRATCH_OVERHEAD = 2  # source streams + merged/converted output on disk at once
+SCRATCH_DEFAULT_MB = MAX_SEND_MB * SCRATCH_OVERHEAD  # reservation when the size is unknown
+SCRATCH_MAX_WAIT = 300  # seconds a job may wait for space before it is refused
+QUEUE_CAPACITY = 500
+MAX_QUEUED_PER_USER = 20
+MAX_INFLIGHT_PER_USER = 2
+FILE_CACHE_FILE = f"{DATA_DIR}/file_cache.json"
+FILE_CACHE_TTL = 7 * 24 * 3600  # Telegram file_ids stay valid for a long time
+FILE_CACHE_MAX = 5000
+ENGINE_PROCS = int(os.getenv("ENGINE_PROCS", MAX_WORKERS))  # yt-dlp worker processes
+ENGINE_JOB_TIMEOUT = int(os.getenv("ENGINE_JOB_TIMEOUT", 600))  # seconds before a job's process is killed
+ENGINE_PREWARM = os.getenv("ENGINE_PREWARM", "1").lower() in ("1", "true", "yes")  # else the first job starts the engine
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_PER_HOST = 16
+MAX_THUMB_BYTES = 5 * 1024 * 1024
+PROBE_TTL = 300  # probed format lists carry signed URLs, keep them briefly
+PROBE_OPTS = {"noplaylist": True, "quiet": True, "no_warnings": True}
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")  # local Bot API server / bench fake
+EXTRA_PLATFORM_HOSTS = dict(
+    pair.split("=", 1) for pair in os.getenv("EXTRA_PLATFORM_HOSTS", "").split(",") if "=" in pair
+)  # "host=platform,..." e.g. mirrors, or the bench media server
+
+AUDIO_FORCE_MP3 = os.getenv("AUDIO_FORCE_MP3", "").lower() in ("1", "true", "yes")  # always re-encode instead of stream-copying
+SHRINK_OVERSIZE = os.getenv("SHRINK_OVERSIZE", "1").lower() in ("1", "true", "yes")  # re-encode files over MAX_SEND_MB to fit (needs ffmpeg)
+SHRINK_WORKERS = int(os.getenv("SHRINK_WORKERS", 0)) or None  # parallel encodes, unset = half the cores
+SHRINK_MAX_ETA = int(os.getenv("SHRINK_MAX_ETA", 300))  # seconds; longer estimated encodes fall back to the too-large reply
+SHRINK_MAX_SOURCE_MB = 1024  # never fetch more than this to re-encode
+STREAM_UPLOAD = os.getenv("STREAM_UPLOAD", "1").lower() in ("1", "true", "yes")  # pipe single-file videos source -> Telegram
+STREAM_MAX_MB = min(int(os.getenv("STREAM_MAX_MB", 20)), MAX_SEND_MB)  # bigger ones still go through disk
+COOKIE_DIR = os.getenv("COOKIE_DIR", ".")  # <platform>_cookies*.txt jars, several per platform rotate
+PORT = int(os.getenv("PORT", 8080))  # Render assigns PORT
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # public base URL; set = webhook mode, unset = polling
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_DEDUP_TTL = 3600  # Telegram gives up redelivering long before this
+WEBHOOK_DEDUP_MAX = 20000
+JOURNAL_DB = f"{DATA_DIR}/jobs.db"
+JOURNAL_KEEP = 24 * 3600  # finished jobs stay in the journal this long
+MAX_RESUMES = 3  # a job cut off by this many restarts is given up (it may be what crashes us)
+DRAIN_TIMEOUT = int(os.getenv("DRAIN_TIMEOUT", 25))  # seconds running jobs get on SIGTERM; Render waits 30
+# all: one process does everything. frontend: handlers + polling/webhook, jobs go
+# to the broker in JOURNAL_DB. worker: downloads only, claims jobs from it (run
+# as many as there are cores/nodes sharing DATA_DIR and TMP_DIR).
+ROLE = os.getenv("ROLE", "all")
+WORKER_NAME = os.getenv("WORKER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = 60  # a worker silent for this long loses its jobs to another
+HEARTBEAT_INTERVAL = 15
+RELAY_INTERVAL = 1  # frontend: how often finished jobs are picked up
+SERVE_HEALTH = ROLE != "worker" or "PORT" in os.environ  # workers sharing a host need a PORT each
+LOOP_STALL_SECONDS = float(os.getenv("LOOP_STALL_SECONDS", 0.5))  # loop blocked this long: capture the stack
+SLOW_CALLBACK_MS = int(os.getenv("SLOW_CALLBACK_MS", 0))  # >0 turns on asyncio debug mode's slow-callback log
+LOOP_REPORT_INTERVAL = int(os.getenv("LOOP_REPORT_INTERVAL", 600))  # seconds between loop lag summaries in the log
 
 # ===== Load .env =====
-load_dotenv()
 API_TOKEN = os.getenv("API_TOKEN")
 if not API_TOKEN:
     raise RuntimeError("API_TOKEN not found in .env!")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(API_TOKEN.encode()).hexdigest()[:32]
+DIAG_TOKEN = os.getenv("DIAG_TOKEN") or WEBHOOK_SECRET  # /diagnostics?token=...
+
+asyncio_helper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+asyncio_helper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
 
 bot = AsyncTeleBot(API_TOKEN)
+tg = TelegramGovernor(bot)  # rate limits + edit coalescing for the download pipeline
 
 # ===== Globals =====
 FFMPEG_EXISTS = shutil.which("ffmpeg") is not None
-download_queue = asyncio.Queue(maxsize=500)
+journal = JobBroker(JOURNAL_DB)  # job journal; also the work queue when ROLE splits the bot
+if ROLE == "all":
+    download_queue = FairScheduler(QUEUE_CAPACITY, MAX_QUEUED_PER_USER, MAX_INFLIGHT_PER_USER)
+    new_job_state = QUEUED
+else:
+    download_queue = BrokerQueue(journal, WORKER_NAME, QUEUE_CAPACITY, MAX_QUEUED_PER_USER, MAX_INFLIGHT_PER_USER,
+                                 LEASE_SECONDS, on_claim=lambda job: adopt_claimed(job))
+    new_job_state = PENDING  # workers can't claim a row until submit() has admitted it
 insta_usage = {}  # persisted per user for day tracking (in-memory)
 user_data = {}    # persisted usage stats
+usage_store = UsageStore(USAGE_DB)
+dirty_users = set()  # uids changed since the last flush
+dirty_insta = set()
+usage_flush = asyncio.Event()
+busy_workers = 0
+startup = {}  # phase -> seconds from BOOT_AT until it was reached
 lock = asyncio.Lock()
-url_storage = {}  # key -> {url, created_at, platform, msg_id, inline(bool), orig_msg_id}
-cooldown = {}     # user_id -> last_request_ts
+url_storage = TTLStore(URL_TTL_SECONDS, MAX_URL_STORAGE, "url_storage")  # key -> LinkRecord | FileRecord
+cooldown = TTLStore(COOLDOWN_SECONDS, MAX_COOLDOWN_ENTRIES, "cooldown")    # user_id -> last_request_ts
+file_cache = ResultCache(FILE_CACHE_FILE, FILE_CACHE_TTL, FILE_CACHE_MAX)
+inflight = {}     # (canonical url, media_type) -> [subscriber dicts waiting on the running job]
+worker_tasks = []
+idle_workers = set()  # worker tasks waiting in download_queue.get(), cancelled first on drain
+resumed_jobs = {}  # journal id -> (job_dir, format) of a download cut off by a restart
+draining = False   # set on SIGTERM: workers stop taking jobs
+seen_updates = TTLStore(WEBHOOK_DEDUP_TTL, WEBHOOK_DEDUP_MAX, "webhook_updates")  # update_id -> True
+engine = ExtractEngine(ENGINE_PROCS, ENGINE_JOB_TIMEOUT)
+http = HttpClient(limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_PER_HOST)
+probe_cache = TTLStore(PROBE_TTL, MAX_PROBE_CACHE, "probe_cache")  # (canonical url, platform) -> info
+cookie_pool = CookiePool(COOKIE_DIR)
+router = UrlRouter(http, EXTRA_PLATFORM_HOSTS, ttl=SHORT_LINK_TTL)  # platform + canonical post key per link
+shrinker = Shrinker(SHRINK_WORKERS, SHRINK_MAX_ETA)
+streamer = StreamUploader(http, f"{TELEGRAM_API_URL}/bot{API_TOKEN}", STREAM_MAX_MB * 1024 * 1024)
+loop_monitor = LoopMonitor(LOOP_STALL_SECONDS, slow_callback=SLOW_CALLBACK_MS / 1000 or None)
+scratch = ScratchSpace(
+    SCRATCH_DIR,
+    quota_bytes=SCRATCH_QUOTA_MB and SCRATCH_QUOTA_MB * 1024 * 1024,
+    min_free_bytes=SCRATCH_MIN_FREE_MB * 1024 * 1024,
+    default_estimate=SCRATCH_DEFAULT_MB * 1024 * 1024,
+    max_wait=SCRATCH_MAX_WAIT,
+)
+
+
+# ===== Metrics (served on /metrics by web_server) =====
+STAGE_SECONDS = REGISTRY.histogram("tb_stage_seconds", "Time spent in each download_worker stage", ("stage", "platform"))
+JOBS_TOTAL = REGISTRY.counter("tb_jobs_total", "Finished download jobs", ("platform", "result"))
+COOKIE_FALLBACKS = REGISTRY.counter("tb_cookie_fallback_total", "Downloads retried with a cookie file", ("platform",))
+COOKIE_RESULTS = REGISTRY.counter("tb_cookie_jar_results_total", "Attempts made with each cookie jar", ("platform", "jar", "result"))
+BYTES_IN = REGISTRY.counter("tb_bytes_in_total", "Media bytes downloaded from platforms", ("platform",))
+BYTES_OUT = REGISTRY.counter("tb_bytes_out_total", "Media bytes uploaded to Telegram", ("platform",))
+THROUGHPUT = REGISTRY.histogram(
+    "tb_download_throughput_bytes_per_second", "Download throughput per job, by platform, tuning profile and protocol",
+    ("platform", "profile", "protocol"),
+    buckets=tuple(2 ** i * 128 * 1024 for i in range(10)),  # 128 KiB/s .. 64 MiB/s
+)
+EXTRACT_SECONDS = REGISTRY.histogram("tb_extract_seconds", "Probe extraction time by extractor dispatch", ("platform", "dispatch"))
+
+def tmp_disk_usage():
+    du = shutil.disk_usage(TMP_DIR)
+    return {("used",): du.used, ("free",): du.free, ("total",): du.total}
+
+REGISTRY.gauge("tb_queue_depth", "Jobs waiting in download_queue", fn=lambda: download_queue.qsize())
+REGISTRY.gauge("tb_workers_busy", "download_worker tasks currently running a job", fn=lambda: busy_workers)
+REGISTRY.gauge("tb_workers_total", "download_worker tasks", fn=lambda: MAX_WORKERS)
+REGISTRY.gauge("tb_engine_busy", "Engine processes currently running a job", fn=lambda: engine.busy)
+REGISTRY.gauge("tb_inflight_subscribers", "Users waiting on a coalesced job", fn=lambda: sum(len(v) for v in inflight.values()))
+REGISTRY.gauge("tb_tmp_disk_bytes", "Disk usage of the filesystem holding TMP_DIR", ("kind",), fn=tmp_disk_usage)
+REGISTRY.gauge("tb_scratch_reserved_bytes", "Scratch space reserved by running jobs", fn=lambda: scratch.reserved)
+REGISTRY.gauge("tb_scratch_jobs", "Jobs holding a scratch directory", fn=lambda: scratch.stats()["active"])
+REGISTRY.gauge("tb_scratch_admissions", "Scratch admission outcomes since start", ("result",), fn=lambda: {
+    ("admitted",): scratch.admitted, ("delayed",): scratch.delayed, ("refused",): scratch.refused})
+REGISTRY.gauge("tb_audio_jobs", "Audio outputs since start, stream-copied vs re-encoded", ("mode",), fn=lambda: {
+    ("copy",): audio_engine.copies, ("encode",): audio_engine.encodes})
+REGISTRY.gauge("tb_audio_cpu_seconds", "ffmpeg CPU time for audio output: spent, and estimated saved by copying", ("kind",), fn=lambda: {
+    ("spent",): audio_engine.cpu_spent, ("saved",): audio_engine.cpu_saved})
+REGISTRY.gauge("tb_shrink_jobs", "Fit-to-limit re-encodes since start", ("result",), fn=lambda: {
+    ("done",): shrinker.done, ("failed",): shrinker.failed, ("rejected",): shrinker.rejected})
+REGISTRY.gauge("tb_short_links", "Short link expansions since start", ("result",), fn=lambda: {
+    ("cached",): router.hits, ("expanded",): router.expansions, ("failed",): router.failures})
+REGISTRY.gauge("tb_startup_seconds", "Seconds from process start until each startup phase", ("phase",), fn=lambda: {
+    (phase,): seconds for phase, seconds in startup.items()})
+REGISTRY.gauge("tb_engine_start_seconds", "Engine cold start: slowest child's yt_dlp import, and all children up and warm", ("kind",), fn=lambda: {
+    ("import",): engine.import_seconds or 0, ("total",): engine.start_seconds or 0})
+REGISTRY.gauge("tb_extract_dispatch", "Extractions by dispatch: pinned to the platform's extractor or generic", ("path",), fn=lambda: {
+    (path,): n for path, n in engine.dispatch.items()})
+REGISTRY.gauge("tb_stream_uploads", "Videos piped from the source to Telegram without touching disk", ("result",), fn=lambda: {
+    ("streamed",): streamer.streamed, ("fell_back",): streamer.fallbacks})
+REGISTRY.gauge("tb_jobs_resumed", "Journaled jobs re-queued after a restart", fn=lambda: journal.resumed)
+REGISTRY.gauge("tb_file_cache_hits", "file_id cache hits", fn=lambda: file_cache.hits)
+REGISTRY.gauge("tb_file_cache_misses", "file_id cache misses", fn=lambda: file_cache.misses)
 
 
 # ===== Persistent usage load/save =====
 def load_usage():
     global user_data, insta_usage
     try:
-        if os.path.exists(USAGE_FILE):
-            with open(USAGE_FILE, "r") as f:
-                user_data = json.load(f)
-        else:
-            user_data = {}
+        usage_store.open()
+        migrated = usage_store.migrate_json(USAGE_FILE, INSTA_FILE)
+        if migrated:
+            print(f"[*] Migrated {migrated} usage records from JSON into {USAGE_DB}")
+        user_data, insta_usage = usage_store.load()
     except Exception as e:
         print("load_usage error:", e)
-        user_data = {}
+        user_data, insta_usage = {}, {}
 
-    try:
-        if os.path.exists(INSTA_FILE):
-            with open(INSTA_FILE, "r") as f:
-                insta_usage = json.load(f)
-        else:
-            insta_usage = {}
-    except Exception as e:
-        print("load_insta_usage error:", e)
-        insta_usage = {}
+def mark_usage_dirty(uid, insta=False):
+    # Hot path: only remember what changed, auto_save_loop commits it in batches
+    (dirty_insta if insta else dirty_users).add(uid)
+    usage_flush.set()
+
+def _take_dirty():
+    users = {uid: dict(user_data[uid]) for uid in dirty_users if uid in user_data}
+    insta = {uid: dict(insta_usage[uid]) for uid in dirty_insta if uid in insta_usage}
+    dirty_users.clear()
+    dirty_insta.clear()
+    return users, insta
 
 def save_usage():
+    # Synchronous flush, used on exit
     try:
-        with open(USAGE_FILE, "w") as f:
-            json.dump(user_data, f)
+        usage_store.write(*_take_dirty())
     except Exception as e:
         print("save_usage error:", e)
+    if ROLE != "worker":  # the frontend owns the file; workers' finds reach it via the journal
+        file_cache.save()
 
-    try:
-        with open(INSTA_FILE, "w") as f:
-            json.dump(insta_usage, f)
-    except Exception as e:
-        print("save_insta_usage error:", e)
-
-# periodic auto-save every 60 sec
+# batched async flush: commits shortly after changes, and at least every 60 sec
 async def auto_save_loop():
     while True:
-        await asyncio.sleep(60)
-        save_usage()
+        try:
+            await asyncio.wait_for(usage_flush.wait(), 60)
+            await asyncio.sleep(USAGE_FLUSH_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        usage_flush.clear()
+        users, insta = _take_dirty()
+        try:
+            await asyncio.to_thread(usage_store.write, users, insta)
+        except Exception as e:
+            print("save_usage error:", e)
+            for uid in users: dirty_users.add(uid)
+            for uid in insta: dirty_insta.add(uid)
+        await asyncio.to_thread(file_cache.write, file_cache.snapshot())
 
 atexit.register(save_usage)
 
-def _handle_exit(sig, frame):
-    print(f"Received exit {sig}, saving data...")
-    save_usage()
-    try:
-        loop = asyncio.get_event_loop()
-        loop.stop()
-    except Exception:
-        pass
-
-signal.signal(signal.SIGINT, _handle_exit)
-signal.signal(signal.SIGTERM, _handle_exit)
 load_usage()
+file_cache.load()
+journal.open()
 
 # ===== Helpers =====
 def short_hash(s: str) -> str:
     return hashlib.md5(s.encode("utf-8")).hexdigest()[:12]
 
-def detect_platform(url: str):
-    u = url.lower()
-    if "instagram.com" in u: return "instagram"
-    if any(x in u for x in ["twitter.com", "x.com", "t.co"]): return "twitter"
-    if any(x in u for x in ["facebook.com", "fb.watch", "fb.com"]): return "facebook"
-    if any(x in u for x in ["tiktok.com", "vm.tiktok.com"]): return "tiktok"
-    return None
+def write_text(path, text):
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(text)
+
+def sent_file(msg):
+    for kind in ("video", "animation", "audio", "voice", "document"):
+        obj = getattr(msg, kind, None)
+        if obj:
+            return kind, obj.file_id
+    return None, None
+
+async def send_by_file_id(chat_id, entry, reply_to, caption):
+    send = {
+        "video": bot.send_video,
+        "animation": bot.send_animation,
+        "audio": bot.send_audio,
+        "voice": bot.send_voice,
+        "document": bot.send_document,
+    }[entry["kind"]]
+    kwargs = {"supports_streaming": True} if entry["kind"] == "video" else {}
+    return await tg.call(chat_id, send, chat_id, entry["file_id"], reply_to_message_id=reply_to, caption=caption, parse_mode="HTML", **kwargs)
+
+def status_edit(chat_id, msg_id, text, resend_on_fail=False):
+    # Coalesced: if an older status for this message hasn't gone out yet, only this text is sent
+    tg.edit(chat_id, msg_id, text, resend_on_fail=resend_on_fail, parse_mode="HTML")
+
+def generic_format(media_type):
+    if media_type == "audio":
+        return "bestaudio" if FFMPEG_EXISTS else "bestaudio/best"
+    return "bestvideo+bestaudio/best" if FFMPEG_EXISTS else "best"
+
+def job_priority(url, media_type):
+    # Cache hits and audio are cheap, let them past queued video downloads
+    if media_type == "audio" or file_cache.peek(ResultCache.make_key(router.key(url), media_type, generic_format(media_type))):
+        return PRIO_HIGH
+    return PRIO_NORMAL
+
+async def send_cached(chat_id, status_id, reply_to, user_id, url, platform, media_type):
+    # Repeat link: resend the stored file_id instead of queueing a job. Worker
+    # processes never see the frontend's cache, so this is where hits are served.
+    cache_key = ResultCache.make_key(router.key(url), media_type, generic_format(media_type))
+    if not file_cache.peek(cache_key):
+        return False
+    cached = file_cache.get(cache_key)
+    icon = "🎵" if media_type == "audio" else "🎬"
+    try:
+        await send_by_file_id(chat_id, cached, reply_to, f"{icon} <b>{cached.get('title') or 'Your file'}</b> — \n<b>TB_Loader</b>")
+    except Exception as e:
+        print("Cached send failed, downloading again:", e)
+        file_cache.invalidate(cache_key)
+        return False
+    if status_id:
+        status_edit(chat_id, status_id, "✅ <b>Sent successfully! Enjoy! 🎉</b>")
+    record_download(user_id, cached.get("size_mb", 0.0))
+    JOBS_TOTAL.inc(platform, "cached")
+    return True
+
+def flight_key(url, media_type):
+    return (router.key(url), media_type)
+
+def record_download(user_id, size_mb):
+    if ROLE == "worker":
+        return  # booked by the frontend when the result comes back
+    uid = str(user_id)
+    ud = user_data.get(uid, {"downloads":0, "total_mb":0.0, "last_download": None})
+    ud["downloads"] = ud.get("downloads", 0) + 1
+    ud["total_mb"] = ud.get("total_mb", 0.0) + size_mb
+    ud["last_download"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    user_data[uid] = ud
+    mark_usage_dirty(uid)
 
 async def shorten_url(url: str) -> str:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://is.gd/create.php?format=simple&url={url}") as r:
-                if r.status == 200:
-                    txt = await r.text()
-                    return txt.strip()
+        txt = await http.fetch_text("https://is.gd/create.php", params={"format": "simple", "url": url})
+        return txt.strip()
     except Exception:
         pass
     return url
 
-def cleanup_url_storage():
-    now = time.time()
-    to_del = [k for k,v in url_storage.items() if now - v.get("created_at",0) > URL_TTL_SECONDS]
-    for k in to_del:
-        url_storage.pop(k, None)
-
 # ===== Inline Keyboard Command Helpers (EDIT IN PLACE) =====
 async def send_start_keyboard(chat_id, msg_id=None):
     markup = InlineKeyboardMarkup(row_width=3)
@@ -216,6 +441,52 @@ async def send_about_keyboard(chat_id, msg_id=None):
         return sent.message_id
     
 
+async def send_stats_keyboard(chat_id, msg_id=None):
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        InlineKeyboardButton("🏠 Start", callback_data="start"),
+        InlineKeyboardButton("📄 Profile", callback_data="profile")
+    )
+    cs = file_cache.stats()
+    es = engine.stats()
+    engine_start = f"warm in {es['start_seconds']:.1f}s" if es["warm"] else "cold"
+    hs = http.stats()
+    gs = tg.stats()
+    state_kb = sum(s.memory_usage() for s in (url_storage, cooldown, probe_cache)) / 1024
+    ss = scratch.stats()
+    jars = [j for p in cookie_pool.stats().values() for j in p["jars"]]
+    aus = audio_engine.stats()
+    shs = shrinker.stats()
+    ls = loop_monitor.summary(reset=False)
+    sts = streamer.stats()
+    fleet_line = ""
+    if ROLE == "frontend":
+        fleet = journal.fleet(LEASE_SECONDS)
+        fleet_line = f"Fleet: {len(fleet)} workers • {sum(b for _, b, _ in fleet)}/{sum(c for _, _, c in fleet)} busy\n"
+    msg = (
+        "📊 <b>Bot Stats</b>\n"
+        f"Users: {len(user_data)}\n"
+        f"Queue: {download_queue.qsize()}/{download_queue.capacity}\n"
+        f"{fleet_line}"
+        f"Engine: {es['busy']}/{es['size']} busy • {es['timeouts']} timeouts • {es['crashes']} crashes • {es['pinned']} pinned / {es['generic']} generic • {engine_start}\n"
+        f"Telegram: {gs['calls']} calls • {gs['edits_coalesced']} edits coalesced • {gs['flood_waits']} flood waits • p95 wait {gs['wait_p95']:.1f}s\n"
+        f"HTTP: {hs['connections_reused']} reused / {hs['connections_created']} new connections • {hs['retries']} retries\n"
+        f"Scratch: {ss['active']} jobs • {ss['reserved'] / (1024*1024):.0f} MB reserved • {ss['delayed']} delayed / {ss['refused']} refused\n"
+        f"Cookies: {len(jars)} jars • {sum(1 for j in jars if j['benched_for'])} benched • {cookie_pool.reloads} reloads\n"
+        f"Audio: {aus['copies']} copied / {aus['encodes']} encoded • ~{aus['cpu_saved']:.0f}s CPU saved\n"
+        f"Loop: p99 lag {ls['lag_p99'] * 1000:.0f}ms • max {ls['lag_max'] * 1000:.0f}ms • {ls['stalls']} stalls\n"
+        f"Streamed: {sts['streamed']} videos • {sts['bytes'] / (1024*1024):.0f} MB • {sts['fallbacks']} fell back to disk\n"
+        f"Shrink: {shs['done']} fitted • {shs['rejected']} rejected • {shs['failed']} failed • {shs['waiting']} waiting\n"
+        f"State: {len(url_storage)} links • {len(cooldown)} cooldowns • {len(probe_cache)} probes (~{state_kb:.0f} KB)\n"
+        f"Cache: {cs['entries']} files • {cs['hits']} hits / {cs['misses']} misses ({cs['hit_rate']*100:.0f}%)"
+    )
+    if msg_id:
+        await bot.edit_message_text(msg, chat_id, msg_id, parse_mode="HTML", reply_markup=markup)
+    else:
+        sent = await bot.send_message(chat_id, msg, parse_mode="HTML", reply_markup=markup)
+        return sent.message_id
+
+
 # ===== Convert Audio Keyboard =====
 async def send_convert_audio_keyboard(chat_id, msg_id=None):
     markup = InlineKeyboardMarkup(row_width=2)
@@ -225,7 +496,7 @@ async def send_convert_audio_keyboard(chat_id, msg_id=None):
     )
     msg = (
         "🎵 <b>Convert Audio</b>\n\n"
-        "Send me a video file, and I will convert it to audio (MP3) for you.\n\n"
+        f"Send me a video file, and I will {'convert it to audio (MP3)' if AUDIO_FORCE_MP3 else 'extract its audio'} for you.\n\n"
         "• Works with videos up to 50MB\n"
         "• Use /start to return to main menu"
     )
@@ -263,6 +534,10 @@ async def about(m):
 async def convert_audio(m):
     await send_convert_audio_keyboard(m.chat.id)
 
+@bot.message_handler(commands=["stats"])
+async def stats_cmd(m):
+    await send_stats_keyboard(m.chat.id)
+
 
 
 # ===== Inline callback handler for menu navigation (edit in place) =====
@@ -284,6 +559,8 @@ async def inline_commands(call):
         await send_about_keyboard(chat_id, msg_id)
     elif cmd == "convert": 
         await send_convert_audio_keyboard(chat_id, msg_id)  # <-- call your new function
+    elif cmd == "stats": 
+        await send_stats_keyboard(chat_id, msg_id)
 
 
 
@@ -305,15 +582,12 @@ async def handle_video_file(message):
     key = short_hash(file_id + str(time.time()))
     markup = InlineKeyboardMarkup(row_width=1)
     markup.add(
-        InlineKeyboardButton("🎵 Convert to Audio (MP3)", callback_data=f"convert_{key}")
+        InlineKeyboardButton("🎵 Convert to Audio (MP3)" if AUDIO_FORCE_MP3 else "🎵 Extract Audio", callback_data=f"convert_{key}")
     )
 
     # Save file info in memory
-    url_storage[key] = {
-        "file_id": file_id,
-        "chat_id": message.chat.id,
-        "file_name": getattr(file_info, "file_name", "video")
-    }
+    rec = FileRecord(file_id, getattr(file_info, "file_unique_id", None), message.chat.id, getattr(file_info, "file_name", "video"))
+    url_storage[key] = rec
 
    
     status_msg = await bot.send_message(
@@ -321,69 +595,109 @@ async def handle_video_file(message):
         "✅ Video received! Tap below to convert to audio:",
         reply_markup=markup
     )
-    url_storage[key]["status_msg_id"] = status_msg.message_id
+    rec.status_msg_id = status_msg.message_id
 
 
 import aiofiles
 
+# ===== Streaming audio conversion =====
+convert_slots = asyncio.Semaphore(os.cpu_count() or 1)
+audio_engine = AudioEngine(AUDIO_FORCE_MP3, convert_slots)
+
+async def extract_audio(file_url, tmp_file, out_base):
+    # The first bytes decide the input up front, so the body is fetched once:
+    # streamable containers convert straight from the socket, MP4s with the
+    # index at the end (phone recordings) need a seekable input on disk
+    try:
+        head = await http.fetch_bytes(file_url, max_bytes=HEAD_BYTES, headers={"Range": f"bytes=0-{HEAD_BYTES - 1}"})
+    except Exception as e:
+        print("Header read failed, spooling to disk:", e)
+        head = b""
+    if pipeable(head):
+        codec, duration = await audio_engine.probe("pipe:0", head)  # the head already holds the index
+        ext, args, copied = audio_engine.plan(codec)
+        output_file = f"{out_base}.{ext}"
+        async with http.stream("GET", file_url) as resp:
+            if resp.status != 200:
+                raise Exception(f"Failed to download, status {resp.status}")
+            if await audio_engine.transcode("pipe:0", output_file, args, copied, duration, resp):
+                return output_file
+        print("Piped conversion failed, retrying from disk")
+    async with http.stream("GET", file_url) as resp:
+        if resp.status != 200:
+            raise Exception(f"Failed to download, status {resp.status}")
+        async with aiofiles.open(tmp_file, mode="wb") as f:
+            async for chunk in resp.content.iter_chunked(STREAM_CHUNK):
+                await f.write(chunk)
+    output_file, _, _ = await audio_engine.extract(tmp_file, out_base)
+    return output_file
+
 # ===== Convert Callback =====
 @bot.callback_query_handler(func=lambda c: c.data and c.data.startswith("convert_"))
 async def handle_convert_callback(call):
     await bot.answer_callback_query(call.id)
     key = call.data.split("_", 1)[1]
     rec = url_storage.get(key)
-    if not rec:
+    if not isinstance(rec, FileRecord):
         await bot.send_message(call.message.chat.id, "❌ Video expired or missing!")
         return
 
-    chat_id = rec["chat_id"]
-    file_id = rec["file_id"]
-    file_name = rec.get("file_name", "video")
-    msg_id = rec.get("status_msg_id") 
-    tmp_file = os.path.join(TMP_DIR, f"{key}.mp4")
-    output_file = os.path.join(TMP_DIR, f"{key}.mp3")
+    chat_id = rec.chat_id
+    file_id = rec.file_id
+    file_name = rec.file_name or "video"
+    msg_id = rec.status_msg_id
+    job_dir = None
+    caption = f"🎵 {file_name} — " + ("Converted to MP3" if AUDIO_FORCE_MP3 else "Audio extracted")
 
     try:
-        await bot.edit_message_text("⏳ Downloading video...", chat_id, msg_id)
+        # --- Same clip converted before: resend by file_id ---
+        cache_key = None
+        if rec.file_unique_id:
+            cache_key = ResultCache.make_key(f"tg:{rec.file_unique_id}", "audio", "mp3" if AUDIO_FORCE_MP3 else "auto")
+            cached = file_cache.get(cache_key)
+            if cached:
+                try:
+                    await tg.call(chat_id, bot.send_audio, chat_id, cached["file_id"], caption=caption)
+                    tg.edit(chat_id, msg_id, "✅ Audio sent!")
+                    return
+                except Exception as e:
+                    print("Cached conversion send failed, converting again:", e)
+                    file_cache.invalidate(cache_key)
+
+        if not FFMPEG_EXISTS:
+            await bot.send_message(chat_id, "⚠️ FFmpeg not installed. Cannot convert.")
+            return
+
+        job_dir = await scratch.acquire(name="conv", on_wait=lambda: tg.edit(chat_id, msg_id, "⏳ Waiting for free disk space..."))
+        tmp_file = os.path.join(job_dir, "in.mp4")
+        tg.edit(chat_id, msg_id, "⏳ Downloading video...")
 
         # --- Get file info ---
         file_info = await bot.get_file(file_id)
         file_path = file_info.file_path
-        file_url = f"https://api.telegram.org/file/bot{API_TOKEN}/{file_path}"
-
-        # --- Download video using aiohttp ---
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url) as resp:
-                if resp.status == 200:
-                    f = await aiofiles.open(tmp_file, mode='wb')
-                    await f.write(await resp.read())
-                    await f.close()
-                else:
-                    raise Exception(f"Failed to download, status {resp.status}")
-
-        # --- Convert using ffmpeg ---
-        if FFMPEG_EXISTS:
-            cmd = f'ffmpeg -y -i "{tmp_file}" -vn -ab 192k -ar 44100 -f mp3 "{output_file}"'
-            os.system(cmd)
-        else:
-            await bot.send_message(chat_id, "⚠️ FFmpeg not installed. Cannot convert.")
-            return
+        file_url = f"{TELEGRAM_API_URL}/file/bot{API_TOKEN}/{file_path}"
 
-        await bot.edit_message_text("📤 Conversion complete! Sending audio...", chat_id, msg_id)
-        # --- Send audio ---
-        async with aiofiles.open(output_file, "rb") as f:
-            await bot.send_audio(chat_id, f, caption=f"🎵 {file_name} — Converted to MP3")
+        # --- Stream into ffmpeg (stream-copy when the codec allows) ---
+        output_file = await extract_audio(file_url, tmp_file, os.path.join(job_dir, "out"))
 
+        tg.edit(chat_id, msg_id, "📤 Conversion complete! Sending audio...")
+        # --- Send audio ---
+        with open(output_file, "rb") as f:
+            sent = await tg.call(chat_id, bot.send_audio, chat_id, f, caption=caption)
+        kind, sent_id = sent_file(sent)
+        if cache_key and sent_id:
+            file_cache.put(cache_key, kind, sent_id, os.path.getsize(output_file) / (1024*1024), file_name)
+
+    except DiskFull as e:
+        print("Conversion refused:", e)
+        tg.edit(chat_id, msg_id, "💾 Server is low on disk space, try again later!")
     except Exception as e:
         print("Conversion error:", e)
-        await bot.edit_message_text("❌ Conversion failed!", chat_id, msg_id)
+        tg.edit(chat_id, msg_id, "❌ Conversion failed!")
     finally:
-        # Cleanup
-        for f in [tmp_file, output_file]:
-            try: os.remove(f)
-            except: pass
-        if key in url_storage:
-            url_storage.pop(key, None)
+        if job_dir:
+            await scratch.release(job_dir)
+        url_storage.pop(key, None)
 
 
 
@@ -398,8 +712,7 @@ async def handle_message(message):
 
     uid = message.from_user.id
     now = time.time()
-    last_ts = cooldown.get(uid, 0)
-    if now - last_ts < COOLDOWN_SECONDS:
+    if uid in cooldown:
         await bot.reply_to(message, f"⏳ Please wait {COOLDOWN_SECONDS} seconds between requests.")
         return
     cooldown[uid] = now
@@ -410,12 +723,19 @@ async def handle_message(message):
         return
 
     single = len(links) == 1
+    valid = []
 
-    for url in links:
-        platform = detect_platform(url)
-        if not platform:
+    seen = set()
+    # Short links expand concurrently: one slow redirect doesn't hold up the rest
+    routes = await asyncio.gather(*(router.resolve(url) for url in links))
+    for url, route in zip(links, routes):
+        if not route:
             await bot.reply_to(message, f"⚠️ <b>Unsupported link:</b>\n{url}", parse_mode="HTML")
             continue
+        if route.key in seen:
+            continue  # same post shared twice in one message
+        seen.add(route.key)
+        url, platform = route.url, route.platform
 
         async with lock:
             today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
@@ -430,38 +750,61 @@ async def handle_message(message):
                     continue
                 rec["count"] += 1
             insta_usage[user_key] = rec
-            save_usage() 
+            mark_usage_dirty(user_key, insta=True)
 
+        valid.append((url, platform))
 
-        key = short_hash(url + str(time.time()))
-        callback_data = f"{key}_{platform}_{message.message_id}"
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("🎬 Video", callback_data=f"v_{callback_data}"),
-            InlineKeyboardButton("🎵 Audio", callback_data=f"a_{callback_data}")
-        )
+    if len(valid) > 1:
+        await send_batch_keyboard(message, valid)
+        return
+    for url, platform in valid:
+        await send_link_keyboard(message.chat.id, url, platform, message.message_id, single)
 
-        pmap = {"instagram":"Instagram","twitter":"Twitter/X","facebook":"Facebook","tiktok":"TikTok"}
+PLATFORM_NAMES = {"instagram":"Instagram","twitter":"Twitter/X","facebook":"Facebook","tiktok":"TikTok"}
 
-        if single:
-            sent = await bot.send_message(message.chat.id,
-                f"✅ <b>{pmap[platform]}</b> Detected!\n<i>Choose format below 👇</i>",
-                reply_markup=markup,
-                parse_mode="HTML"
-            )
-            url_storage[key] = {"url": url, "created_at": time.time(), "platform": platform, "msg_id": sent.message_id, "inline": True, "orig_msg_id": message.message_id}
-        else:
-            sent = await bot.reply_to(message,
-                f"✅ <b>{pmap[platform]}</b> Detected!\n<i>Choose format below 👇</i>",
-                reply_markup=markup,
-                parse_mode="HTML"
-            )
-            url_storage[key] = {"url": url, "created_at": time.time(), "platform": platform, "msg_id": sent.message_id, "inline": False, "orig_msg_id": message.message_id}
+async def send_link_keyboard(chat_id, url, platform, orig_msg_id, single):
+    key = short_hash(url + str(time.time()))
+    callback_data = f"{key}_{platform}_{orig_msg_id}"
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        InlineKeyboardButton("🎬 Video", callback_data=f"v_{callback_data}"),
+        InlineKeyboardButton("🎵 Audio", callback_data=f"a_{callback_data}")
+    )
+    sent = await bot.send_message(chat_id,
+        f"✅ <b>{PLATFORM_NAMES[platform]}</b> Detected!\n<i>Choose format below 👇</i>",
+        reply_to_message_id=None if single else orig_msg_id,
+        reply_markup=markup,
+        parse_mode="HTML"
+    )
+    url_storage[key] = LinkRecord(url, platform, sent.message_id, single, orig_msg_id)
 
-    if len(url_storage) > MAX_URL_STORAGE:
-        cleanup_url_storage()
+async def send_batch_keyboard(message, links):
+    # One control for the whole message instead of a keyboard per link
+    key = short_hash(f"batch{message.chat.id}{message.message_id}{time.time()}")
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        InlineKeyboardButton("⬇️ All Video", callback_data=f"bv_{key}"),
+        InlineKeyboardButton("⬇️ All Audio", callback_data=f"ba_{key}")
+    )
+    markup.add(InlineKeyboardButton("🔢 One by one", callback_data=f"bo_{key}"))
+    names = ", ".join(sorted({PLATFORM_NAMES[p] for _, p in links}))
+    sent = await bot.reply_to(message,
+        f"✅ <b>{len(links)} links</b> Detected! ({names})\n<i>Download them all at once, or pick one by one 👇</i>",
+        reply_markup=markup,
+        parse_mode="HTML"
+    )
+    url_storage[key] = BatchRecord(links, sent.message_id, message.message_id)
 
 # ===== Callback handler =====
+async def show_status(chat_id, msg_id, text):
+    # Edit the keyboard message into a status line (a new message if that fails) -> its id
+    try:
+        await tg.call(chat_id, bot.edit_message_text, text, chat_id, msg_id, parse_mode="HTML", priority=INTERACTIVE)
+        return msg_id
+    except Exception:
+        status_msg = await tg.call(chat_id, bot.send_message, chat_id, text, parse_mode="HTML", priority=INTERACTIVE)
+        return status_msg.message_id
+
 @bot.callback_query_handler(func=lambda c: c.data and c.data.startswith(("v_","a_")))
 async def handle_callback(call):
     await bot.answer_callback_query(call.id)
@@ -470,25 +813,72 @@ async def handle_callback(call):
         rest = call.data[2:]
         key, platform, orig_msgid = rest.rsplit("_", 2)
         rec = url_storage.get(key)
-        if not rec:
+        if not isinstance(rec, LinkRecord):
             try:
                 await bot.send_message(call.message.chat.id, "❌ <b>Link expired!</b> Send again.", parse_mode="HTML")
             except:
                 pass
             return
 
-        url = rec["url"]
+        url = rec.url
         media_type = "video" if prefix == "v" else "audio"
-        msg_id_to_edit = rec.get("msg_id")
+        msg_id_to_edit = rec.msg_id
         chat_id = call.message.chat.id
 
-        try:
-            await bot.edit_message_text("⏳ <b>Starting download...</b>\n⚡ <i>Processing</i>", chat_id, msg_id_to_edit, parse_mode="HTML")
-        except Exception:
-            status_msg = await bot.send_message(chat_id, "⏳ <b>Starting download...</b>\n⚡ <i>Processing</i>", parse_mode="HTML")
-            msg_id_to_edit = status_msg.message_id
+        user_id = call.from_user.id
+
+        if await send_cached(chat_id, msg_id_to_edit, rec.orig_msg_id or msg_id_to_edit, user_id, url, platform, media_type):
+            url_storage.pop(key, None)
+            return
+
+        # Same link already downloading: ride along instead of queueing another job
+        fkey = flight_key(url, media_type)
+        priority = job_priority(url, media_type)
+        shown = False  # the keyboard message already shows a status
+        if fkey in inflight:
+            msg_id_to_edit = await show_status(chat_id, msg_id_to_edit, "⏳ <b>Already downloading this link...</b>\n⚡ <i>You'll get it as soon as it's ready</i>")
+            shown = True
+            # The leader may have finished during that edit; then its file is likely cached
+            if fkey not in inflight and await send_cached(chat_id, msg_id_to_edit, rec.orig_msg_id or msg_id_to_edit, user_id, url, platform, media_type):
+                url_storage.pop(key, None)
+                return
+
+        if fkey not in inflight:
+            try:
+                download_queue.admit(user_id)
+            except QueueFull as e:
+                busy_text = "🚦 <b>Too many downloads queued!</b>\n<i>Wait for your current links to finish, then tap again</i>"
+                if str(e) == "queue is full":
+                    busy_text = "🚦 <b>Bot is busy right now!</b>\n<i>Please try again in a minute</i>"
+                if shown:
+                    status_edit(chat_id, msg_id_to_edit, busy_text)
+                    return
+                try:
+                    await bot.send_message(chat_id, busy_text, parse_mode="HTML")
+                except:
+                    pass
+                return
+            position = download_queue.next_position(user_id, priority)
+            if position <= 1:
+                status_text = "⏳ <b>Starting download...</b>\n⚡ <i>Processing</i>"
+            else:
+                status_text = f"⏳ <b>Queued</b> — position <b>#{position}</b>\n⚡ <i>Starting soon</i>"
+            msg_id_to_edit = await show_status(chat_id, msg_id_to_edit, status_text)
 
-        await download_queue.put((chat_id, url, platform, msg_id_to_edit, call.from_user.id, media_type, rec.get("orig_msg_id", None), key))
+        # Checked after every await above: a flight may have started or ended meanwhile
+        if fkey in inflight:
+            job_id = journal.add(chat_id, url, platform, msg_id_to_edit, user_id, media_type, rec.orig_msg_id, url_key=key, state=JOINED)
+            inflight[fkey].append({"chat_id": chat_id, "status_id": msg_id_to_edit, "user_id": user_id, "reply_to": rec.orig_msg_id, "url_key": key, "job_id": job_id})
+            return
+
+        job_id = journal.add(chat_id, url, platform, msg_id_to_edit, user_id, media_type, rec.orig_msg_id, url_key=key, state=new_job_state)
+        inflight[fkey] = []
+        try:
+            await download_queue.put(user_id, (chat_id, url, platform, msg_id_to_edit, user_id, media_type, rec.orig_msg_id, key, time.time(), None, job_id), priority)
+        except QueueFull:
+            inflight.pop(fkey, None)
+            journal.finish(job_id, "rejected")
+            status_edit(chat_id, msg_id_to_edit, "🚦 <b>Bot is busy right now!</b>\n<i>Please try again in a minute</i>")
     except Exception as e:
         print("Callback error:", e)
         try:
@@ -496,163 +886,703 @@ async def handle_callback(call):
         except:
             pass
 
+# ===== Batch mode =====
+def batch_status_text(b):
+    icon = "🎵" if b.media_type == "audio" else "🎬"
+    head = "✅ <b>Batch complete!</b>" if b.finished else f"⏳ <b>Downloading {b.total} links...</b>"
+    line = f"{icon} Sent: {b.sent} • ⏳ Pending: {b.pending} • ❌ Failed: {b.failed}"
+    if b.too_large:
+        line += f" • 📦 Too large: {b.too_large}"
+    return f"{head}\n{line}"
+
+async def send_album(chat_id, reply_to, user_id, media_type, items):
+    # One send_media_group call for up to ALBUM_MAX items (a plain send for a single one)
+    icon = "🎵" if media_type == "audio" else "🎬"
+    handles = []
+    try:
+        sources, media = [], []
+        for it in items:
+            src = it.file_id
+            if src is None:
+                src = open(it.path, "rb")
+                handles.append(src)
+            sources.append(src)
+            caption = f"{icon} <b>{it.title or 'Your file'}</b>"
+            if media_type == "audio":
+                media.append(InputMediaAudio(src, caption=caption, parse_mode="HTML"))
+            else:
+                media.append(InputMediaVideo(src, caption=caption, parse_mode="HTML", supports_streaming=True))
+        upload_started = time.monotonic()
+        if len(media) == 1:
+            send = bot.send_audio if media_type == "audio" else bot.send_video
+            kwargs = {"supports_streaming": True} if media_type == "video" else {}
+            sent = [await tg.call(chat_id, send, chat_id, sources[0], reply_to_message_id=reply_to, caption=media[0].caption, parse_mode="HTML", **kwargs)]
+        else:
+            sent = await tg.call(chat_id, bot.send_media_group, chat_id, media, reply_to_message_id=reply_to)
+        STAGE_SECONDS.observe(time.monotonic() - upload_started, "upload", "batch")
+    finally:
+        for fh in handles:
+            fh.close()
+        for it in items:
+            journal.finish(it.job_id, "batched")
+            if it.job_dir:
+                await scratch.release(it.job_dir)
+
+    delivered = 0
+    for it, msg in zip(items, sent):
+        kind, sent_id = sent_file(msg)
+        if not sent_id:
+            continue
+        delivered += 1
+        if it.file_id is None:
+            file_cache.put(it.cache_key, kind, sent_id, it.size_mb, it.title)
+            BYTES_OUT.inc(it.platform, amount=int(it.size_mb * 1024 * 1024))
+        record_download(user_id, it.size_mb)
+    return delivered
+
+@bot.callback_query_handler(func=lambda c: c.data and c.data.startswith(("bv_", "ba_", "bo_")))
+async def handle_batch_callback(call):
+    await bot.answer_callback_query(call.id)
+    mode, key = call.data.split("_", 1)
+    rec = url_storage.pop(key, None)  # one tap per batch
+    chat_id = call.message.chat.id
+    if not isinstance(rec, BatchRecord):
+        try:
+            await bot.send_message(chat_id, "❌ <b>Links expired!</b> Send again.", parse_mode="HTML")
+        except:
+            pass
+        return
+
+    if mode == "bo":
+        status_edit(chat_id, rec.msg_id, "👇 <b>Choose a format for each link</b>")
+        for url, platform in rec.links:
+            await send_link_keyboard(chat_id, url, platform, rec.orig_msg_id, False)
+        return
+
+    user_id = call.from_user.id
+    media_type = "video" if mode == "bv" else "audio"
+    status_id = rec.msg_id
+    if ROLE == "frontend":
+        # A Batch can't span worker processes: each link runs as its own job with its own status
+        status_edit(chat_id, status_id, f"⏳ <b>Queued {len(rec.links)} links</b>\n⚡ <i>Each one is sent as soon as it's ready</i>")
+        for url, platform in rec.links:
+            if await send_cached(chat_id, None, rec.orig_msg_id, user_id, url, platform, media_type):
+                continue
+            msg = await tg.call(chat_id, bot.send_message, chat_id, "⏳ <b>Queued</b>", reply_to_message_id=rec.orig_msg_id, parse_mode="HTML", priority=INTERACTIVE)
+            job_id = journal.add(chat_id, url, platform, msg.message_id, user_id, media_type, rec.orig_msg_id, url_key=key, state=new_job_state)
+            try:
+                await download_queue.put(user_id, (chat_id, url, platform, msg.message_id, user_id, media_type, rec.orig_msg_id, key, time.time(), None, job_id), job_priority(url, media_type))
+            except QueueFull:
+                journal.finish(job_id, "rejected")
+                status_edit(chat_id, msg.message_id, "🚦 <b>Bot is busy right now!</b>\n<i>Please try again in a minute</i>")
+        return
+    batch = Batch(
+        len(rec.links), media_type,
+        flush=lambda items: send_album(chat_id, rec.orig_msg_id, user_id, media_type, items),
+        on_progress=lambda b: status_edit(chat_id, status_id, batch_status_text(b)),
+    )
+    status_edit(chat_id, status_id, batch_status_text(batch))
+    # Links run in parallel as far as the scheduler's per-user in-flight budget allows
+    for url, platform in rec.links:
+        job_id = journal.add(chat_id, url, platform, status_id, user_id, media_type, rec.orig_msg_id, batch=True, url_key=key, state=new_job_state)
+        try:
+            await download_queue.put(user_id, (chat_id, url, platform, status_id, user_id, media_type, rec.orig_msg_id, key, time.time(), batch, job_id), job_priority(url, media_type))
+        except QueueFull:
+            journal.finish(job_id, "rejected")
+            await batch.fail()
+
+# ===== Probe phase (download=False) =====
+async def probe(platform, url, jar=None):
+    key = (router.key(url), platform)
+    info = probe_cache.get(key)
+    if info is not None:
+        return info
+    opts = dict(PROBE_OPTS, **probe_options(platform), **CookiePool.options(jar))
+    try:
+        info, timings = await engine.run_timed(platform, opts, url, download=False)
+    except ExtractError as e:
+        cookie_pool.report(platform, jar, False, e)
+        raise
+    cookie_pool.report(platform, jar, bool(info))
+    STAGE_SECONDS.observe(timings["total"], "extract", platform)
+    if "dispatch" in timings:
+        EXTRACT_SECONDS.observe(timings["total"], platform, timings["dispatch"])
+    if info:
+        probe_cache[key] = info
+    return info
+
+# ===== Cookie-aware download =====
+async def download_media(platform, ydl_opts, url, probed, jar):
+    # First attempt uses the jar chosen up front (None = anonymous); a failure
+    # cookies could fix gets one retry with another jar, re-extracted with it
+    for attempt in (1, 2):
+        info, timings, err = None, None, None
+        try:
+            info, timings = await engine.run_timed(platform, dict(ydl_opts, **CookiePool.options(jar)), url, download=True, info=probed)
+        except ExtractError as e:
+            err = e
+        kind = cookie_pool.report(platform, jar, bool(info), err)
+        if jar is not None:
+            COOKIE_RESULTS.inc(platform, jar.name, "ok" if info else kind)
+        if info:
+            return info, timings
+        if isinstance(err, ExtractTimeout) or (err is not None and kind == "other"):
+            break
+        retry = cookie_pool.pick(platform, exclude=jar) if attempt == 1 else None
+        if retry is None:
+            break
+        COOKIE_FALLBACKS.inc(platform)
+        jar, probed = retry, None
+    if err is not None:
+        raise err
+    raise Exception("Download failed (no info)")
+
+def shrink_source(info, media_type):
+    # (format, est_bytes) to download for a fit-to-limit re-encode, or None when
+    # it can't fit or would take too long
+    if not (SHRINK_OVERSIZE and FFMPEG_EXISTS):
+        return None
+    try:
+        plan = shrinker.plan(info.get("duration"), media_type == "video", MAX_SEND_MB * 1024 * 1024)
+    except Hopeless as e:
+        print("Not compressing:", e)
+        return None
+    floor = plan.height if plan.video else plan.audio_kbps
+    return pick_shrink_source(info, media_type, floor, SHRINK_MAX_SOURCE_MB * 1024 * 1024, FFMPEG_EXISTS)
+
+async def stream_video(chat_id, fmt, info, reply_to, caption):
+    # Pipelined upload of a single progressive file; None = use the disk path
+    filename = f"{short_hash(info.get('webpage_url') or fmt['url'])}.mp4"
+    try:
+        result, size, seconds = await tg.call(
+            chat_id, streamer.send, "sendVideo", "video", fmt["url"], fmt.get("http_headers"), filename, "video/mp4", {
+                "chat_id": chat_id, "reply_to_message_id": reply_to, "caption": caption, "parse_mode": "HTML", "supports_streaming": True,
+                "duration": int(info["duration"]) if info.get("duration") else None, "width": fmt.get("width"), "height": fmt.get("height"),
+            },
+        )
+    except Exception as e:
+        streamer.fallbacks += 1
+        print("Streamed upload failed, downloading to disk instead:", e)
+        return None
+    return Message.de_json(result), size, seconds
+
+async def send_too_large_fallback(chat_id, url, status_id, reply_to, size_mb=None):
+    size_txt = f" (~{size_mb:.0f} MB)" if size_mb else ""
+    async with scratch.job(64 * 1024, "html") as job_dir:
+        html_path = os.path.join(job_dir, f"{short_hash(url)}.html")
+        page = f"<html><body><h3>Download File</h3><p>Original: <a href=\"{url}\">{url}</a></p></body></html>"
+        await asyncio.to_thread(write_text, html_path, page)  # disk I/O stays off the event loop
+        status_edit(chat_id, status_id, f"❌ <b>File too large{size_txt}!</b> Failed to send\n<i>Sent fallback download page</i>")
+        with open(html_path, "rb") as fh:
+            await tg.call(chat_id, bot.send_document, chat_id, fh, reply_to_message_id=reply_to, caption=f"⚠️ File >{MAX_SEND_MB}MB — open this page to download manually")
+
+# ===== Single-flight fan-out =====
+async def deliver_to_subscriber(sub, outcome, entry, caption):
+    chat_id, status_id = sub["chat_id"], sub["status_id"]
+    text = "❌ <b>Download failed!</b>\nTry again"
+    try:
+        if outcome == "sent" and entry:
+            await send_by_file_id(chat_id, entry, sub["reply_to"] or status_id, caption)
+            record_download(sub["user_id"], entry.get("size_mb", 0.0))
+            text = "✅ <b>Sent successfully! Enjoy! 🎉</b>"
+        elif outcome == "sent":
+            outcome = "failed"  # sent to the leader, but without a file_id to pass on
+        elif outcome == "too_large":
+            text = f"❌ <b>File too large!</b> Failed to send\n<i>Files up to {MAX_SEND_MB}MB</i>"
+    except Exception as e:
+        print("Subscriber delivery error:", e)
+    status_edit(chat_id, status_id, text)
+    journal.finish(sub.get("job_id"), outcome)
+    url_storage.pop(sub["url_key"], None)
+
+async def fan_out(subs, outcome, entry, caption):
+    await asyncio.gather(*(deliver_to_subscriber(s, outcome, entry, caption) for s in subs))
+
 # ===== Download Worker =====
 async def download_worker(worker_id:int):
-    while True:
-        chat_id, url, platform, status_id, user_id, media_type, reply_to_user_msgid, url_key = await download_queue.get()
-        timestamp = int(time.time())
-        tmp_base = f"{TMP_DIR}/dl_{chat_id}_{status_id}_{timestamp}"
+    global busy_workers
+    me = asyncio.current_task()
+    while not draining:
+        idle_workers.add(me)
+        try:
+            _, (chat_id, url, platform, status_id, user_id, media_type, reply_to_user_msgid, url_key, queued_at, batch, job_id) = await download_queue.get()
+        finally:
+            idle_workers.discard(me)
+        if draining:
+            # Still journaled as queued: the next process picks it up
+            download_queue.done(user_id)
+            break
+        busy_workers += 1
+        STAGE_SECONDS.observe(time.time() - queued_at, "queue_wait", platform)
+        job_dir = None
         final_path = None
+        fkey = flight_key(url, media_type)
+        outcome, result, caption = "failed", None, None
+        cache_key = None
+        from_cache = False
+        batched = False  # result handed to a Batch, which sends and cleans up
+        resume = resumed_jobs.pop(job_id, None)  # (job_dir, format) left by a restart
+
+        def notify(text, resend_on_fail=False):
+            # Batch items share one aggregated status message, updated by the Batch itself
+            if batch is None:
+                status_edit(chat_id, status_id, text, resend_on_fail)
+
         try:
             ydl_opts = {
                 "noplaylist": True,
                 "quiet": True,
                 "no_warnings": True,
-                "outtmpl": f"{tmp_base}.%(ext)s",
             }
+            ydl_opts.update(ydl_options(platform, media_type))  # per-platform fragments/chunks/retries
 
-            if media_type == "audio":
-                if FFMPEG_EXISTS:
-                    ydl_opts["format"] = "bestaudio"
-                    ydl_opts["postprocessors"] = [{"key": "FFmpegExtractAudio", "preferredcodec": "mp3"}]
-                else:
-                    ydl_opts["format"] = "bestaudio/best"
-            else:
-                if FFMPEG_EXISTS:
-                    ydl_opts["format"] = "bestvideo+bestaudio/best"
+            ydl_opts["format"] = generic_format(media_type)
+            if FFMPEG_EXISTS:
+                if media_type == "video":
                     ydl_opts["merge_output_format"] = "mp4"
-                else:
-                    ydl_opts["format"] = "best"
-
-            info = None
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, url, download=True)
-
-            if not info:
-                cookie_file = f"{platform}_cookies.txt"
-                if os.path.exists(cookie_file):
-                    ydl_opts["cookiefile"] = cookie_file
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = await asyncio.to_thread(ydl.extract_info, url, download=True)
+                # audio: audio_engine picks stream-copy or MP3 after the download
+
+            reply_to = reply_to_user_msgid or status_id
+            cache_key = ResultCache.make_key(router.key(url), media_type, ydl_opts["format"])
+            cached = file_cache.get(cache_key)
+            if cached and batch is not None and cached.get("kind") == media_type:
+                outcome, from_cache, batched = "batched", True, True
+                await batch.add(BatchItem(url, platform, cached.get("title"), cached.get("size_mb", 0.0), cache_key, file_id=cached["file_id"], job_id=job_id))
+                continue
+            if cached and batch is None:
+                icon = "🎵" if media_type == "audio" else "🎬"
+                caption = f"{icon} <b>{cached.get('title') or 'Your file'}</b> — \n<b>TB_Loader</b>"
+                try:
+                    await send_by_file_id(chat_id, cached, reply_to, caption)
+                    outcome, result, from_cache = "sent", cached, True
+                    notify("✅ <b>Sent successfully! Enjoy! 🎉</b>")
+                    record_download(user_id, cached.get("size_mb", 0.0))
+                    continue
+                except Exception as e:
+                    print(f"Worker {worker_id} cached send failed, re-downloading:", e)
+                    file_cache.invalidate(cache_key)
 
-            if not info:
-                raise Exception("Download failed (no info)")
+            # Start with cookies when anonymous access has been failing for this platform
+            jar = cookie_pool.choose(platform)
 
-            ext = info.get("ext", "mp4") if media_type == "video" else "mp3"
+            # Probe first so oversized media is rejected (or downselected) before any bytes move
+            journal.mark(job_id, EXTRACTING)
+            probed = None
+            try:
+                probed = await probe(platform, url, jar)
+            except Exception as e:
+                print(f"Worker {worker_id} probe failed, downloading directly:", e)
+                if jar is None and classify_error(e) != "other":
+                    jar = cookie_pool.pick(platform)  # looks like a login wall, don't fail the download the same way
+
+            est_bytes, verdict = None, None
+            if resume and resume[1]:
+                ydl_opts["format"] = resume[1]  # same streams as before the restart, so their .part files continue
+            elif probed:
+                verdict, spec, est_bytes = pick_format(probed, media_type, MAX_SEND_MB * 1024 * 1024, FFMPEG_EXISTS, ydl_opts.get("format_sort"))
+                if verdict == TOO_LARGE:
+                    # Fetch the smallest source that still re-encodes well, or give up before any bytes move
+                    source = shrink_source(probed, media_type)
+                    if source is None:
+                        outcome = "too_large"
+                        if batch is None:
+                            await send_too_large_fallback(chat_id, url, status_id, reply_to, est_bytes / (1024*1024))
+                        continue
+                    spec, est_bytes = source
+                    ydl_opts["format"] = spec
+                if verdict == FITS:
+                    ydl_opts["format"] = spec
+
+            # One progressive mp4 that needs no merge or postprocessing: source bytes go
+            # straight into the upload, so download and upload overlap and disk is skipped
+            fmt = None
+            if STREAM_UPLOAD and batch is None and media_type == "video" and verdict == FITS and not resume:
+                fmt = stream_format(probed, ydl_opts["format"], STREAM_MAX_MB * 1024 * 1024)
+            streamed = None
+            if fmt:
+                title = probed.get("title", "Your file")
+                caption = f"🎬 <b>{title}</b> — \n<b>TB_Loader</b>"
+                journal.mark(job_id, UPLOADING)
+                notify("📤 <b>Sending directly...</b>")
+                streamed = await stream_video(chat_id, fmt, probed, reply_to, caption)
+                if not streamed:
+                    # Falling back to download-then-upload: say so, don't leave "Sending" up
+                    journal.mark(job_id, DOWNLOADING)
+                    notify("⏳ <b>Downloading...</b>")
+            if streamed:
+                sent, size_bytes, seconds = streamed
+                size_mb = size_bytes / (1024*1024)
+                STAGE_SECONDS.observe(seconds, "stream", platform)
+                BYTES_IN.inc(platform, amount=size_bytes)
+                BYTES_OUT.inc(platform, amount=size_bytes)
+                outcome = "sent"
+                kind, sent_id = sent_file(sent)
+                if sent_id:
+                    file_cache.put(cache_key, kind, sent_id, size_mb, title)
+                    result = {"kind": kind, "file_id": sent_id, "size_mb": size_mb, "title": title}
+                notify("✅ <b>Sent successfully! Enjoy! 🎉</b>")
+                record_download(user_id, size_mb)
+                continue
+
+            # Reserve disk before any bytes are written; waits while other jobs hold the space
+            reserve = est_bytes and est_bytes * SCRATCH_OVERHEAD
+            if resume and resume[0]:
+                job_dir = resume[0]  # adopted at startup, partial files included
+            else:
+                job_dir = await scratch.acquire(
+                    reserve,
+                    f"dl_{chat_id}_{status_id}",
+                    on_wait=lambda: notify("⏳ <b>Waiting for free disk space...</b>"),
+                )
+            journal.mark(job_id, DOWNLOADING, job_dir=job_dir, format=ydl_opts["format"], reserved=reserve)
+            tmp_base = os.path.join(job_dir, "dl")
+            ydl_opts["outtmpl"] = f"{tmp_base}.%(ext)s"
+
+            info, timings = await download_media(platform, ydl_opts, url, probed, jar)
+
+            ext = info.get("ext", "mp4")
             candidate = f"{tmp_base}.{ext}"
             if os.path.exists(candidate):
                 final_path = candidate
             else:
-                for f in os.listdir(TMP_DIR):
-                    if f.startswith(os.path.basename(tmp_base)):
-                        final_path = os.path.join(TMP_DIR, f)
+                for f in os.listdir(job_dir):
+                    if f.startswith("dl.") and not f.endswith((".part", ".ytdl")):
+                        final_path = os.path.join(job_dir, f)
                         break
 
             if not final_path or not os.path.exists(final_path):
                 raise Exception("File not found after download")
 
-            size_mb = os.path.getsize(final_path) / (1024*1024)
+            size_bytes = os.path.getsize(final_path)
+            size_mb = size_bytes / (1024*1024)
+            STAGE_SECONDS.observe(timings.get("download", timings["total"]), "download", platform)
+            if "postprocess" in timings:
+                STAGE_SECONDS.observe(timings["postprocess"], "postprocess", platform)
+            BYTES_IN.inc(platform, amount=timings["bytes"] or size_bytes)
+            if timings.get("download") and timings["bytes"]:
+                THROUGHPUT.observe(timings["bytes"] / timings["download"], platform, profile_id(platform), info.get("protocol") or "unknown")
+
+            if media_type == "audio" and FFMPEG_EXISTS:
+                # Stream-copy when Telegram plays the source codec, encode to MP3 only otherwise
+                pp_started = time.monotonic()
+                final_path, _, _ = await audio_engine.extract(final_path, os.path.join(job_dir, "audio"), hint=info.get("acodec"))
+                STAGE_SECONDS.observe(time.monotonic() - pp_started, "postprocess", platform)
+                size_bytes = os.path.getsize(final_path)
+                size_mb = size_bytes / (1024*1024)
+
+            if size_mb > MAX_SEND_MB and SHRINK_OVERSIZE and FFMPEG_EXISTS:
+                notify(f"🗜 <b>Too big ({size_mb:.0f} MB), compressing to fit...</b>")
+                shrink_started = time.monotonic()
+                try:
+                    duration = info.get("duration") or (await audio_engine.probe(final_path))[1]
+                    final_path = await shrinker.shrink(final_path, os.path.join(job_dir, "fit"), duration, media_type == "video", MAX_SEND_MB * 1024 * 1024)
+                    STAGE_SECONDS.observe(time.monotonic() - shrink_started, "shrink", platform)
+                    size_bytes = os.path.getsize(final_path)
+                    size_mb = size_bytes / (1024*1024)
+                except Exception as e:
+                    print(f"Worker {worker_id} fit-to-limit failed:", e)
+
+            journal.mark(job_id, UPLOADING)
+            if batch is not None and size_mb <= MAX_SEND_MB:
+                item = BatchItem(url, platform, info.get("title", "Your file"), size_mb, cache_key, path=final_path, job_dir=job_dir, job_id=job_id)
+                job_dir, outcome, batched = None, "batched", True  # the batch releases the dir once the album is out
+                await batch.add(item)
+                continue
 
             # ===== Thumbnail fix: don't send thumbnail for video =====
+            # (nor for a batch item: it only gets here when too large, and sends no track)
             thumb = None
-            if media_type == "audio" and isinstance(info, dict):
+            if media_type == "audio" and batch is None and isinstance(info, dict):
                 thumb = info.get("thumbnail")
             if thumb:
                 try:
                     reply_to = reply_to_user_msgid or status_id
-                    await bot.send_photo(chat_id, thumb, reply_to_message_id=reply_to)
+                    photo = await http.fetch_bytes(thumb, max_bytes=MAX_THUMB_BYTES)
+                    await tg.call(chat_id, bot.send_photo, chat_id, photo, reply_to_message_id=reply_to)
                 except Exception:
                     pass
 
-            try:
-                await bot.edit_message_text(f"⚙️ <b>Processing complete!</b>\nSize: <i>{size_mb:.1f} MB</i>", chat_id, status_id, parse_mode="HTML")
-            except:
-                pass
+            notify(f"⚙️ <b>Processing complete!</b>\nSize: <i>{size_mb:.1f} MB</i>")
 
             if size_mb > MAX_SEND_MB:
-                html_path = os.path.join(TMP_DIR, f"{short_hash(url)}.html")
-                try:
-                    with open(html_path, "w", encoding="utf-8") as fh:
-                        fh.write(f"<html><body><h3>Download File</h3><p>Original: <a href=\"{url}\">{url}</a></p></body></html>")
-                    try:
-                        await bot.edit_message_text("❌ <b>File too large!</b> Failed to send\n<i>Sent fallback download page</i>", chat_id, status_id, parse_mode="HTML")
-                    except:
-                        pass
-                    with open(html_path, "rb") as fh:
-                        await bot.send_document(chat_id, fh, reply_to_message_id=reply_to_user_msgid or status_id, caption="⚠️ File >50MB — open this page to download manually")
-                finally:
-                    try: os.remove(html_path)
-                    except: pass
+                outcome = "too_large"
+                if batch is None:
+                    await send_too_large_fallback(chat_id, url, status_id, reply_to)
             else:
-                try:
-                    await bot.edit_message_text("📤 <b>Sending directly...</b>", chat_id, status_id, parse_mode="HTML")
-                except:
-                    pass
+                notify("📤 <b>Sending directly...</b>")
+                upload_started = time.monotonic()
                 with open(final_path, "rb") as fh:
                     title = info.get("title", "Your file")
                     if media_type == "audio":
-                        await bot.send_audio(chat_id, fh, reply_to_message_id=reply_to_user_msgid or status_id, caption=f"🎵 <b>{title}</b> — \n<b>TB_Loader</b>", parse_mode="HTML")
+                        caption = f"🎵 <b>{title}</b> — \n<b>TB_Loader</b>"
+                        sent = await tg.call(chat_id, bot.send_audio, chat_id, fh, reply_to_message_id=reply_to_user_msgid or status_id, caption=caption, parse_mode="HTML")
                     else:
-                        await bot.send_video(chat_id, fh, supports_streaming=True, reply_to_message_id=reply_to_user_msgid or status_id, caption=f"🎬 <b>{title}</b> — \n<b>TB_Loader</b>", parse_mode="HTML")
-                try:
-                    await bot.edit_message_text("✅ <b>Sent successfully! Enjoy! 🎉</b>", chat_id, status_id, parse_mode="HTML")
-                except:
-                    pass
-
-            uid = str(user_id)
-            ud = user_data.get(uid, {"downloads":0, "total_mb":0.0, "last_download": None})
-            ud["downloads"] = ud.get("downloads", 0) + 1
-            ud["total_mb"] = ud.get("total_mb", 0.0) + size_mb
-            ud["last_download"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            user_data[uid] = ud
-            save_usage() 
-
+                        caption = f"🎬 <b>{title}</b> — \n<b>TB_Loader</b>"
+                        sent = await tg.call(chat_id, bot.send_video, chat_id, fh, supports_streaming=True, reply_to_message_id=reply_to_user_msgid or status_id, caption=caption, parse_mode="HTML")
+                STAGE_SECONDS.observe(time.monotonic() - upload_started, "upload", platform)
+                BYTES_OUT.inc(platform, amount=size_bytes)
+                outcome = "sent"
+                kind, sent_id = sent_file(sent)
+                if sent_id:
+                    file_cache.put(cache_key, kind, sent_id, size_mb, title)
+                    result = {"kind": kind, "file_id": sent_id, "size_mb": size_mb, "title": title}
+                notify("✅ <b>Sent successfully! Enjoy! 🎉</b>")
+
+            record_download(user_id, size_mb)
+
+        except asyncio.CancelledError:
+            # Shutdown deadline hit: keep the journal row and scratch dir so the next process resumes it
+            outcome = "interrupted"
+            notify("♻️ <b>Bot is restarting...</b>\n<i>Your download will resume automatically</i>")
+            raise
+        except DiskFull as e:
+            print(f"Worker {worker_id} refused:", e)
+            outcome = "no_space"
+            notify("💾 <b>Server is low on disk space!</b>\n<i>Please try again later</i>", resend_on_fail=True)
         except Exception as e:
             print(f"Worker {worker_id} error:", e)
-            try:
-                await bot.edit_message_text("❌ <b>Download failed!</b>\nTry again", chat_id, status_id, parse_mode="HTML")
-            except:
-                try:
-                    await bot.send_message(chat_id, "❌ <b>Download failed!</b>\nTry again", parse_mode="HTML")
-                except:
-                    pass
+            notify("❌ <b>Download failed!</b>\nTry again", resend_on_fail=True)
         finally:
-            try:
-                for f in os.listdir(TMP_DIR):
-                    if f.startswith(os.path.basename(tmp_base)) or f.startswith(f"m_{chat_id}_{status_id}"):
-                        try: os.remove(os.path.join(TMP_DIR, f))
-                        except: pass
-            except Exception:
-                pass
-            try:
-                if url_key in url_storage:
-                    url_storage.pop(url_key, None)
-            except:
-                pass
-            download_queue.task_done()
+            busy_workers -= 1
+            download_queue.done(user_id)
+            if outcome != "interrupted":
+                if job_dir:
+                    await scratch.release(job_dir)
+                if not batched:
+                    # The result lets a frontend in another process answer ride-alongs and fill its cache
+                    journal.finish(job_id, outcome, result and dict(result, caption=caption, cache_key=cache_key))
+                if batch is not None and not batched:
+                    await batch.fail(too_large=outcome == "too_large")
+                url_storage.pop(url_key, None)
+                JOBS_TOTAL.inc(platform, "cached" if from_cache else outcome)
+                subs = inflight.pop(fkey, []) if batch is None else None
+                if subs:
+                    await fan_out(subs, outcome, result, caption)
 
 # ===== Background tmp cleaner =====
 async def tmp_cleaner():
+    # Only job dirs live under SCRATCH_DIR, so this is one scandir of the stale ones
     while True:
+        await asyncio.sleep(TMP_CLEAN_INTERVAL)
         try:
-            now = time.time()
-            for f in os.listdir(TMP_DIR):
-                path = os.path.join(TMP_DIR, f)
-                try:
-                    if os.path.isfile(path) and os.path.getmtime(path) < now - TMP_CLEAN_INTERVAL and (f.startswith("dl_") or f.endswith(".html") or f.endswith(".tmp")):
-                        os.remove(path)
-                except Exception:
-                    pass
+            live = await asyncio.to_thread(journal.live_dirs)
+            removed = await asyncio.to_thread(scratch.reclaim, TMP_CLEAN_INTERVAL, live)
+            if removed:
+                print(f"tmp_cleaner: removed {removed} stale scratch dirs")
+            journal.prune(JOURNAL_KEEP)
         except Exception as e:
             print("tmp_cleaner error:", e)
-        await asyncio.sleep(TMP_CLEAN_INTERVAL)
+
+# ===== Crash resume / graceful drain =====
+async def resume_jobs():
+    # Unfinished journal rows are jobs a restart cut off: queue them again,
+    # keeping their scratch dirs so partial downloads continue
+    rows = journal.unfinished()
+    for job in rows:
+        if job.attempts >= MAX_RESUMES:
+            journal.finish(job.id, "abandoned")
+            status_edit(job.chat_id, job.status_id, "❌ <b>Download failed!</b>\nTry again")
+            continue
+        journal.requeue(job.id)
+        text = "♻️ <b>Resuming after a restart...</b>\n⚡ <i>Processing</i>"
+        status_id = job.status_id
+        if job.batch:
+            # The batch and its shared status are gone; this link finishes on its own
+            try:
+                msg = await tg.call(job.chat_id, bot.send_message, job.chat_id, text, reply_to_message_id=job.reply_to, parse_mode="HTML")
+            except Exception as e:
+                print(f"Resume of job {job.id} failed:", e)
+                journal.finish(job.id, "failed")
+                continue
+            status_id = msg.message_id
+            journal.mark(job.id, status_id=status_id, batch=0)
+        else:
+            status_edit(job.chat_id, status_id, text)
+
+        fkey = flight_key(job.url, job.media_type)
+        if fkey in inflight:
+            inflight[fkey].append({"chat_id": job.chat_id, "status_id": status_id, "user_id": job.user_id, "reply_to": job.reply_to, "url_key": None, "job_id": job.id})
+            continue
+        if job.job_dir and scratch.adopt(job.job_dir, job.reserved):
+            resumed_jobs[job.id] = (job.job_dir, job.format)
+        inflight[fkey] = []
+        try:
+            await download_queue.put(job.user_id, (job.chat_id, job.url, job.platform, status_id, job.user_id, job.media_type, job.reply_to, None, time.time(), None, job.id), job_priority(job.url, job.media_type))
+        except QueueFull:
+            inflight.pop(fkey, None)
+            journal.finish(job.id, "rejected")
+            status_edit(job.chat_id, status_id, "🚦 <b>Bot is busy right now!</b>\n<i>Please try again in a minute</i>")
+    return len(rows)
+
+async def drain(timeout):
+    # SIGTERM: stop taking jobs and give running ones until the deadline; the
+    # rest are cancelled and stay in the journal for the next start
+    global draining
+    draining = True
+    # Idle workers would only claim jobs they won't run (holding broker leases meanwhile)
+    for w in list(idle_workers):
+        w.cancel()
+    deadline = time.monotonic() + timeout
+    while busy_workers and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    if busy_workers:
+        print(f"Drain deadline hit, {busy_workers} jobs will resume after the restart")
+    for w in worker_tasks:
+        w.cancel()
+    await asyncio.gather(*worker_tasks, return_exceptions=True)
+    if ROLE == "worker":
+        released = await asyncio.to_thread(journal.release, WORKER_NAME)  # back to the queue now, not after the lease runs out
+        if released:
+            print(f"Handed {released} jobs back to the queue")
+    await tg.flush(3)
+
+# ===== Split roles (ROLE=frontend / ROLE=worker) =====
+def adopt_claimed(job):
+    # A redelivered job's dir is still there when its last worker shared this TMP_DIR
+    if job.job_dir and scratch.adopt(job.job_dir, job.reserved):
+        resumed_jobs[job.id] = (job.job_dir, job.format)
+
+async def heartbeat_loop():
+    # Worker: keep our leases alive, and redeliver jobs of workers that died
+    while True:
+        try:
+            await asyncio.to_thread(journal.heartbeat, WORKER_NAME, LEASE_SECONDS, busy_workers, MAX_WORKERS)
+            redelivered = await asyncio.to_thread(journal.expire, MAX_RESUMES)
+            if redelivered:
+                print(f"Redelivered {redelivered} jobs from lost workers")
+        except Exception as e:
+            print("heartbeat error:", e)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+async def relay_results():
+    # Frontend: workers sent the files themselves; book usage, fill the file
+    # cache and answer the users who rode along on each job
+    last_expire = 0.0
+    while True:
+        await asyncio.sleep(RELAY_INTERVAL)
+        try:
+            if time.monotonic() - last_expire >= HEARTBEAT_INTERVAL:
+                last_expire = time.monotonic()
+                await asyncio.to_thread(journal.expire, MAX_RESUMES)
+            for _, chat_id, url, status_id, user_id, media_type, url_key, outcome, result in await asyncio.to_thread(journal.results):
+                entry = json.loads(result) if result else None
+                if outcome == "sent" and entry:
+                    record_download(user_id, entry.get("size_mb", 0.0))
+                    if entry.get("cache_key"):
+                        file_cache.put(entry["cache_key"], entry["kind"], entry["file_id"], entry.get("size_mb", 0.0), entry.get("title"))
+                elif outcome == "abandoned":
+                    status_edit(chat_id, status_id, "❌ <b>Download failed!</b>\nTry again")
+                url_storage.pop(url_key, None)
+                subs = inflight.pop(flight_key(url, media_type), None)
+                if subs:
+                    await fan_out(subs, outcome, entry, entry and entry.get("caption"))
+        except Exception as e:
+            print("relay_results error:", e)
+
+# ===== Readiness (/ready) =====
+def readiness():
+    if ROLE == "frontend":
+        fleet = journal.fleet(LEASE_SECONDS)
+        details = {
+            "role": ROLE,
+            "fleet_workers": len(fleet),
+            "fleet_busy": sum(busy for _, busy, _ in fleet),
+            "fleet_capacity": sum(cap for _, _, cap in fleet),
+            "queue": download_queue.qsize(),
+            "queue_capacity": download_queue.capacity,
+        }
+        return not download_queue.full(), details  # queueing while no worker is up is fine
+    es = engine.stats()
+    details = {
+        "workers_alive": sum(1 for w in worker_tasks if not w.done()),
+        "workers_total": MAX_WORKERS,
+        "workers_busy": busy_workers,
+        "queue": download_queue.qsize(),
+        "queue_capacity": download_queue.capacity,
+        "engine_alive": es["alive"],
+        "engine_size": es["size"],
+        "engine_warm": es["warm"],
+    }
+    # A cold engine starts on demand, so it doesn't hold readiness back
+    ok = details["workers_alive"] == MAX_WORKERS and (es["alive"] > 0 or not es["warm"]) and not download_queue.full()
+    return ok, details
+
+async def prewarm_engine():
+    try:
+        await engine.start()
+    except Exception as e:
+        print("Engine pre-warm failed, jobs will retry the start:", e)
+        return
+    startup["engine"] = time.monotonic() - BOOT_AT
 
 # ===== Main =====
 async def main():
     print("🚀 TB_LOADER PRO+ v3.2 — Starting...")
-    workers = [asyncio.create_task(download_worker(i)) for i in range(MAX_WORKERS)]
+    loop_monitor.start()
+    webhook = bool(WEBHOOK_URL) and ROLE != "worker"
+    server = None
+    if SERVE_HEALTH:
+        server = WebServer(bot, readiness, WEBHOOK_PATH if webhook else None, WEBHOOK_SECRET, seen_updates,
+                           diagnostics=loop_monitor.snapshot, diag_token=DIAG_TOKEN)
+        await server.start("0.0.0.0", PORT)  # health answers right away, /ready flips once workers run
+        startup["health"] = time.monotonic() - BOOT_AT
+    if ROLE != "frontend" and ENGINE_PREWARM:
+        asyncio.create_task(prewarm_engine())  # engine processes import yt_dlp while we finish starting
+    if ROLE != "frontend" and SHRINK_OVERSIZE and FFMPEG_EXISTS:
+        asyncio.create_task(shrinker.calibrate())  # a few seconds of encode sets realistic fit-to-limit ETAs
+    await http.start()
+    journal.prune(JOURNAL_KEEP)
+    if ROLE == "all":
+        resumed = await resume_jobs()  # adopts their scratch dirs, so before reclaim()
+        if resumed:
+            print(f"[*] Resumed {resumed} jobs from the journal")
+    elif ROLE == "frontend":
+        journal.release_joined()  # nobody holds their in-flight entries any more
+    # Split roles may share TMP_DIR with live processes: only stale dirs of finished jobs are theirs to remove
+    removed = scratch.reclaim(None if ROLE == "all" else TMP_CLEAN_INTERVAL, journal.live_dirs())
+    if removed:
+        print(f"Reclaimed {removed} leftover scratch dirs")
+    if ROLE != "frontend":
+        worker_tasks.extend(asyncio.create_task(download_worker(i)) for i in range(MAX_WORKERS))
+    if ROLE == "worker":
+        asyncio.create_task(heartbeat_loop())
+    else:
+        asyncio.create_task(auto_save_loop())
+    if ROLE == "frontend":
+        asyncio.create_task(relay_results())
     asyncio.create_task(tmp_cleaner())
-    await bot.infinity_polling()
+    asyncio.create_task(loop_monitor.report_loop(LOOP_REPORT_INTERVAL))
+    startup["ready"] = time.monotonic() - BOOT_AT
+    print(f"[*] Ready in {startup['ready']:.2f}s")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    polling = None
+    try:
+        if ROLE == "worker":
+            print(f"[*] Worker {WORKER_NAME}: taking jobs from {JOURNAL_DB}")
+        elif webhook:
+            await bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, max_connections=MAX_WORKERS * 4)
+            print(f"[*] Webhook mode: {WEBHOOK_URL}{WEBHOOK_PATH}")
+        else:
+            await bot.remove_webhook()  # getUpdates is refused while a webhook is set
+            polling = asyncio.create_task(bot.infinity_polling())
+        await stop.wait()
+        print("Received exit signal, draining running jobs...")
+    finally:
+        if polling:
+            bot.stop_polling()
+            polling.cancel()
+        await drain(DRAIN_TIMEOUT)
+        if server:
+            await server.stop()
+        loop_monitor.stop()
+        await http.close()
+        if ROLE != "frontend":
+            await engine.close()
+        journal.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+# result_cache.py
+
+import os
+import json
+import time
+from collections import OrderedDict
+
+
+# Telegram file_id cache keyed by (canonical url, media_type, format).
+# A hit resends an already uploaded file with one API call; entries expire
+# after `ttl` seconds and the least recently used one is evicted at `max_entries`.
+class ResultCache:
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._dirty = False
+
+    @staticmethod
+    def make_key(url, media_type, fmt):
+        return f"{url}|{media_type}|{fmt}"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.time() - entry["ts"] > self.ttl:
+            self._entries.pop(key, None)
+            self._dirty = True
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def peek(self, key):
+        # Like get() but without touching LRU order or hit/miss counters
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry["ts"] > self.ttl:
+            return None
+        return entry
+
+    def put(self, key, kind, file_id, size_mb=0.0, title=None):
+        self._entries[key] = {
+            "kind": kind,
+            "file_id": file_id,
+            "size_mb": size_mb,
+            "title": title,
+            "ts": time.time(),
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._dirty = True
+
+    def invalidate(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def purge_expired(self):
+        now = time.time()
+        expired = [k for k, v in self._entries.items() if now - v["ts"] > self.ttl]
+        for k in expired:
+            self._entries.pop(k, None)
+        if expired:
+            self._dirty = True
+        return len(expired)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+    def load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            items = sorted(data.items(), key=lambda kv: kv[1].get("ts", 0))
+            self._entries = OrderedDict(items)
+            self.purge_expired()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = False
+        except Exception as e:
+            print("result_cache load error:", e)
+            self._entries = OrderedDict()
+
+    def snapshot(self):
+        # Copy taken on the event loop; write() can then run in a thread
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return dict(self._entries)
+
+    def write(self, entries):
+        if entries is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self._dirty = True
+            print("result_cache save error:", e)
+
+    def save(self):
+        self.write(self.snapshot())
@@ -0,0 +1,134 @@
+# scheduler.py
+
+import asyncio
+from collections import OrderedDict, deque
+
+PRIO_HIGH = 0    # cheap jobs: cache hits, audio
+PRIO_NORMAL = 1  # full video downloads
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Replacement for a FIFO asyncio.Queue: jobs are queued per user and served
+# round-robin, so one user pasting 40 links cannot starve everyone else.
+# Priority classes share the workers by weight (deficit style) rather than
+# strictly, and submit() never blocks: it returns the queue position or
+# raises QueueFull so the handler can tell the user right away.
+class FairScheduler:
+    def __init__(self, capacity=500, per_user_queued=20, per_user_inflight=2, weights=None):
+        self.capacity = capacity
+        self.per_user_queued = per_user_queued
+        self.per_user_inflight = per_user_inflight
+        self.weights = weights or {PRIO_HIGH: 3, PRIO_NORMAL: 1}
+        self._queues = {p: OrderedDict() for p in self.weights}  # prio -> user -> deque of jobs
+        self._credits = dict(self.weights)
+        self._inflight = {}  # user -> running jobs
+        self._size = 0
+        self._wakeup = asyncio.Event()
+        self.submitted = 0
+        self.rejected = 0
+
+    def qsize(self):
+        return self._size
+
+    def full(self):
+        return self._size >= self.capacity
+
+    def user_queued(self, user_id):
+        return sum(len(q.get(user_id, ())) for q in self._queues.values())
+
+    def admit(self, user_id):
+        if self._size >= self.capacity:
+            self.rejected += 1
+            raise QueueFull("queue is full")
+        if self.user_queued(user_id) >= self.per_user_queued:
+            self.rejected += 1
+            raise QueueFull("too many queued jobs for this user")
+
+    def next_position(self, user_id, priority=PRIO_NORMAL):
+        # Position a job would get if submitted now
+        q = self._queues.get(priority, {}).get(user_id, ())
+        return self._position(user_id, priority, len(q))
+
+    def submit(self, user_id, job, priority=PRIO_NORMAL):
+        self.admit(user_id)
+        if priority not in self._queues:
+            priority = PRIO_NORMAL
+        q = self._queues[priority].setdefault(user_id, deque())
+        q.append(job)
+        self._size += 1
+        self.submitted += 1
+        self._wakeup.set()
+        return self._position(user_id, priority, len(q) - 1)
+
+    async def put(self, user_id, job, priority=PRIO_NORMAL):
+        # Same as submit(); lets callers treat this and BrokerQueue alike
+        return self.submit(user_id, job, priority)
+
+    def _position(self, user_id, priority, index):
+        # Round-robin estimate: every other user gets up to index+1 turns first
+        ahead = index
+        for p, users in self._queues.items():
+            if p > priority:
+                continue
+            for uid, q in users.items():
+                if uid != user_id:
+                    ahead += len(q) if p < priority else min(len(q), index + 1)
+        return ahead + 1
+
+    def _eligible(self, priority):
+        for uid in self._queues[priority]:
+            if self._inflight.get(uid, 0) < self.per_user_inflight:
+                return uid
+        return None
+
+    def _pop(self):
+        ready = [p for p in sorted(self._queues) if self._eligible(p) is not None]
+        if not ready:
+            return None
+        chosen = next((p for p in ready if self._credits[p] > 0), None)
+        if chosen is None:
+            self._credits = dict(self.weights)
+            chosen = ready[0]
+        self._credits[chosen] -= 1
+
+        users = self._queues[chosen]
+        uid = self._eligible(chosen)
+        q = users[uid]
+        job = q.popleft()
+        if q:
+            users.move_to_end(uid)
+        else:
+            del users[uid]
+        self._size -= 1
+        self._inflight[uid] = self._inflight.get(uid, 0) + 1
+        return uid, job
+
+    async def get(self):
+        while True:
+            item = self._pop()
+            if item is not None:
+                return item
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def done(self, user_id):
+        n = self._inflight.get(user_id, 0) - 1
+        if n > 0:
+            self._inflight[user_id] = n
+        else:
+            self._inflight.pop(user_id, None)
+        self._wakeup.set()
+
+    def stats(self):
+        return {
+            "queued": self._size,
+            "capacity": self.capacity,
+            "users_waiting": len({u for q in self._queues.values() for u in q}),
+            "inflight": sum(self._inflight.values()),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "by_priority": {p: sum(len(q) for q in users.values()) for p, users in self._queues.items()},
+        }
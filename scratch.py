@@ -0,0 +1,144 @@
+# scratch.py
+
+import os
+import time
+import shutil
+import asyncio
+import itertools
+import contextlib
+
+
+class DiskFull(Exception):
+    pass
+
+
+def _dir_bytes(path):
+    total = 0
+    for base, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(base, name))
+            except OSError:
+                pass
+    return total
+
+
+# Every job gets its own directory under one root, so finding a job's output
+# never scans a shared /tmp and cleanup is a single rmtree. Before a job
+# writes anything it reserves its estimated size; a job is admitted only if
+# the filesystem keeps min_free bytes after every outstanding reservation,
+# otherwise it waits for running jobs to release space (or is refused).
+class ScratchSpace:
+    def __init__(self, root, quota_bytes=None, min_free_bytes=0, default_estimate=0, max_wait=300):
+        self.root = root
+        self.quota_bytes = quota_bytes      # cap on our own reservations, None = disk only
+        self.min_free_bytes = min_free_bytes
+        self.default_estimate = default_estimate
+        self.max_wait = max_wait
+        self._active = {}  # path -> reserved bytes
+        self._seq = itertools.count()
+        self._released = asyncio.Condition()
+        self.admitted = 0
+        self.delayed = 0
+        self.refused = 0
+        self.reclaimed = 0
+
+    @property
+    def reserved(self):
+        return sum(self._active.values())
+
+    def _fits(self, need, active):
+        # Runs in a thread (walks the job dirs, stats the disk) on a snapshot of _active
+        if self.quota_bytes is not None and sum(r for _, r in active) + need > self.quota_bytes:
+            return False
+        free = shutil.disk_usage(self.root).free
+        # Reserved bytes that are not on disk yet (job dirs hold a handful of files)
+        outstanding = sum(max(0, reserved - _dir_bytes(path)) for path, reserved in active)
+        return free - outstanding - need >= self.min_free_bytes
+
+    def reclaim(self, older_than=None, keep=()):
+        # Remove job dirs nobody owns: everything at startup, stale ones later.
+        # A dir's mtime doesn't move while a file inside it grows, so dirs of
+        # jobs another process still runs must come in keep (journal.live_dirs())
+        os.makedirs(self.root, exist_ok=True)
+        now = time.time()
+        removed = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.path in self._active or entry.path in keep:
+                    continue
+                try:
+                    if older_than is not None and entry.stat(follow_symlinks=False).st_mtime > now - older_than:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+        self.reclaimed += removed
+        return removed
+
+    async def acquire(self, estimate=None, name="job", on_wait=None):
+        need = estimate if estimate else self.default_estimate
+        if self.quota_bytes is not None and need > self.quota_bytes:
+            self.refused += 1
+            raise DiskFull(f"job needs {need} bytes, quota is {self.quota_bytes}")
+        os.makedirs(self.root, exist_ok=True)
+        deadline = time.monotonic() + self.max_wait
+        waited = False
+        async with self._released:
+            while not await asyncio.to_thread(self._fits, need, list(self._active.items())):
+                remaining = deadline - time.monotonic()
+                if not self._active or remaining <= 0:
+                    # Nothing of ours to wait for, or waited long enough
+                    self.refused += 1
+                    raise DiskFull(f"not enough scratch space for {need} bytes")
+                if not waited:
+                    waited = True
+                    self.delayed += 1
+                    if on_wait:
+                        on_wait()
+                try:
+                    # Also re-check periodically: other processes may free disk too
+                    await asyncio.wait_for(self._released.wait(), min(5, remaining))
+                except asyncio.TimeoutError:
+                    pass
+            path = os.path.join(self.root, f"{name}_{os.getpid()}_{next(self._seq)}")
+            os.makedirs(path)
+            self._active[path] = need
+            self.admitted += 1
+            return path
+
+    def adopt(self, path, reserved=None):
+        # Keep a job dir from before a restart (call before reclaim()); True if it still exists
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.root) or not os.path.isdir(path):
+            return False
+        self._active[path] = reserved or self.default_estimate
+        return True
+
+    async def release(self, path):
+        self._active.pop(path, None)
+        await asyncio.to_thread(shutil.rmtree, path, True)
+        async with self._released:
+            self._released.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def job(self, estimate=None, name="job", on_wait=None):
+        path = await self.acquire(estimate, name, on_wait)
+        try:
+            yield path
+        finally:
+            await self.release(path)
+
+    def stats(self):
+        return {
+            "active": len(self._active),
+            "reserved": self.reserved,
+            "quota": self.quota_bytes,
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "refused": self.refused,
+            "reclaimed": self.reclaimed,
+        }
@@ -0,0 +1,170 @@
+# shrink.py
+
+import os
+import time
+import shutil
+import asyncio
+
+# Fit-to-limit re-encode for media that is still over the send limit after
+# format downselection. The bitrate comes from the duration and the byte
+# budget, resolution is capped to what that bitrate can carry, and encodes
+# run niced in a pool no wider than the machine's cores. Plans whose
+# estimated encode time is too long are rejected before anything is
+# downloaded or encoded.
+
+HEADROOM = 0.92       # container overhead and rate-control overshoot
+VIDEO_AUDIO_KBPS = 96
+MIN_VIDEO_KBPS = 150  # below this the result is not worth sending
+MIN_AUDIO_KBPS = 40
+MAX_AUDIO_KBPS = 192
+# (minimum video kbps, max height): more bits allow more lines
+HEIGHT_LADDER = ((2500, 1080), (1200, 720), (600, 480), (300, 360), (0, 240))
+# Media seconds encoded per wall second per slot (veryfast, 2 threads), by
+# output height, None = audio. Scaled by calibrate() and then by measured encodes.
+DEFAULT_SPEED = {1080: 1.5, 720: 3.0, 480: 6.0, 360: 10.0, 240: 16.0, None: 40.0}
+CALIBRATION_HEIGHT = 480
+CALIBRATION_SECONDS = 4
+THREADS_PER_ENCODE = 2
+NICE = ["nice", "-n", "10"] if shutil.which("nice") else []  # downloads and uploads keep their CPU share
+
+
+class Hopeless(Exception):
+    pass
+
+
+class ShrinkPlan:
+    __slots__ = ("video", "video_kbps", "audio_kbps", "height", "eta")
+
+    def __init__(self, video, video_kbps, audio_kbps, height, eta):
+        self.video = video
+        self.video_kbps = video_kbps
+        self.audio_kbps = audio_kbps
+        self.height = height
+        self.eta = eta
+
+
+class Shrinker:
+    def __init__(self, workers=None, max_eta=300):
+        cores = os.cpu_count() or 1
+        self.workers = workers or max(1, cores // THREADS_PER_ENCODE)
+        self.max_eta = max_eta
+        self._slots = asyncio.Semaphore(self.workers)
+        self._waiting = 0
+        self._speed = dict(DEFAULT_SPEED)  # output height -> realtime factor (EMA once measured)
+        self.calibrated = None  # measured/default speed ratio from the sample encode
+        self.done = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def plan(self, duration, video, limit_bytes):
+        if not duration or duration <= 0:
+            self.rejected += 1
+            raise Hopeless("unknown duration")
+        total_kbps = limit_bytes * 8 * HEADROOM / 1000 / duration
+        if video:
+            audio_kbps = min(VIDEO_AUDIO_KBPS, max(MIN_AUDIO_KBPS, total_kbps * 0.15))
+            video_kbps = total_kbps - audio_kbps
+            if video_kbps < MIN_VIDEO_KBPS:
+                self.rejected += 1
+                raise Hopeless(f"{video_kbps:.0f} kbps video for {duration:.0f}s")
+            height = next(h for kbps, h in HEIGHT_LADDER if video_kbps >= kbps)
+        else:
+            audio_kbps = min(MAX_AUDIO_KBPS, total_kbps)
+            if audio_kbps < MIN_AUDIO_KBPS:
+                self.rejected += 1
+                raise Hopeless(f"{audio_kbps:.0f} kbps audio for {duration:.0f}s")
+            video_kbps, height = 0, None
+        # Queue ahead of us counts: each waiting encode delays the slot we get
+        backlog = 1 + self._waiting / self.workers
+        eta = duration / self._speed[height] * backlog
+        if eta > self.max_eta:
+            self.rejected += 1
+            raise Hopeless(f"encode would take ~{eta:.0f}s")
+        return ShrinkPlan(video, int(video_kbps), int(audio_kbps), height, eta)
+
+    def _video_args(self, p):
+        return [
+            "-c:v", "libx264", "-preset", "veryfast",
+            "-b:v", f"{p.video_kbps}k", "-maxrate", f"{int(p.video_kbps * 1.3)}k", "-bufsize", f"{p.video_kbps * 2}k",
+            "-vf", f"scale=-2:'min({p.height},ih)'", "-pix_fmt", "yuv420p", "-threads", str(THREADS_PER_ENCODE),
+        ]
+
+    def _args(self, p):
+        if not p.video:
+            return ["-vn", "-c:a", "libmp3lame", "-b:a", f"{p.audio_kbps}k", "-f", "mp3"]
+        return [
+            *self._video_args(p),
+            "-c:a", "aac", "-b:a", f"{p.audio_kbps}k", "-ac", "2",
+            "-movflags", "+faststart", "-f", "mp4",
+        ]
+
+    async def shrink(self, src, out_base, duration, video, limit_bytes):
+        p = self.plan(duration, video, limit_bytes)
+        output_file = f"{out_base}.{'mp4' if video else 'mp3'}"
+        self._waiting += 1
+        queued = True
+        try:
+            async with self._slots:
+                self._waiting -= 1
+                queued = False
+                started = time.monotonic()
+                ok = await self._encode(src, output_file, self._args(p))
+        finally:
+            if queued:
+                self._waiting -= 1
+        if not ok:
+            self.failed += 1
+            raise Exception("fit-to-limit encode failed")
+        elapsed = max(time.monotonic() - started, 0.001)
+        self._speed[p.height] = 0.7 * self._speed[p.height] + 0.3 * (duration / elapsed)
+        if os.path.getsize(output_file) > limit_bytes:
+            self.failed += 1
+            raise Hopeless("encode overshot the limit")
+        self.done += 1
+        return output_file
+
+    async def calibrate(self):
+        # Short synthetic encode at startup, so the first ETAs reflect this
+        # machine instead of rejecting long clips on a guessed speed
+        p = ShrinkPlan(True, 600, VIDEO_AUDIO_KBPS, CALIBRATION_HEIGHT, 0)
+        src = f"testsrc2=size=1280x720:rate=30:duration={CALIBRATION_SECONDS}"
+        async with self._slots:
+            started = time.monotonic()
+            ok = await self._encode(src, "-", ["-an", *self._video_args(p), "-f", "null"], ["-f", "lavfi"])
+            elapsed = max(time.monotonic() - started, 0.001)
+        if not ok:
+            return None
+        self.calibrated = CALIBRATION_SECONDS / elapsed / DEFAULT_SPEED[CALIBRATION_HEIGHT]
+        for height in self._speed:
+            if height is not None:
+                self._speed[height] = DEFAULT_SPEED[height] * self.calibrated
+        print(f"Fit-to-limit calibration: {self.calibrated:.2f}x the default encode speed")
+        return self.calibrated
+
+    async def _encode(self, src, output_file, args, input_args=()):
+        proc = await asyncio.create_subprocess_exec(
+            *NICE, "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *input_args, "-i", src, *args, output_file,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, err = await proc.communicate()
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        if proc.returncode != 0:
+            print("fit-to-limit ffmpeg exit", proc.returncode, err.decode(errors="ignore")[-300:])
+        return proc.returncode == 0
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "waiting": self._waiting,
+            "done": self.done,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "calibrated": self.calibrated,
+        }
@@ -0,0 +1,138 @@
+# state_store.py
+
+import sys
+import time
+import heapq
+from collections import OrderedDict
+
+
+# ===== Typed records =====
+class LinkRecord:
+    __slots__ = ("url", "platform", "msg_id", "inline", "orig_msg_id", "created_at")
+
+    def __init__(self, url, platform, msg_id=None, inline=False, orig_msg_id=None):
+        self.url = url
+        self.platform = platform
+        self.msg_id = msg_id
+        self.inline = inline
+        self.orig_msg_id = orig_msg_id
+        self.created_at = time.time()
+
+
+class FileRecord:
+    __slots__ = ("file_id", "file_unique_id", "chat_id", "file_name", "status_msg_id", "created_at")
+
+    def __init__(self, file_id, file_unique_id, chat_id, file_name, status_msg_id=None):
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.chat_id = chat_id
+        self.file_name = file_name
+        self.status_msg_id = status_msg_id
+        self.created_at = time.time()
+
+
+class BatchRecord:
+    __slots__ = ("links", "msg_id", "orig_msg_id", "created_at")
+
+    def __init__(self, links, msg_id, orig_msg_id):
+        self.links = links  # [(url, platform), ...]
+        self.msg_id = msg_id
+        self.orig_msg_id = orig_msg_id
+        self.created_at = time.time()
+
+
+# Dict-like store with per-entry expiry and a hard LRU size cap. Expiry times
+# live in a min-heap (lazy deletion), so expiring an entry costs O(log n)
+# instead of a full scan, and nothing outlives its TTL.
+class TTLStore:
+    def __init__(self, ttl, max_entries, name="store"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.name = name
+        self._data = OrderedDict()  # key -> value, LRU order
+        self._expiry = {}           # key -> expires_at
+        self._heap = []             # (expires_at, seq, key)
+        self._seq = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        self.expire()
+        return key in self._data
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = value
+        self._data.move_to_end(key)
+        self._expiry[key] = expires_at
+        self._seq += 1
+        heapq.heappush(self._heap, (expires_at, self._seq, key))
+        self.expire()
+        while len(self._data) > self.max_entries:
+            old, _ = self._data.popitem(last=False)
+            self._expiry.pop(old, None)
+            self.evicted += 1
+        if len(self._heap) > 2 * len(self._data) + 64:
+            self._compact()
+
+    __setitem__ = set
+
+    def get(self, key, default=None):
+        self.expire()
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def pop(self, key, default=None):
+        self._expiry.pop(key, None)
+        return self._data.pop(key, default)
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        heap = self._heap
+        n = 0
+        while heap and heap[0][0] <= now:
+            expires_at, _, key = heapq.heappop(heap)
+            # Stale heap entries (key re-set or removed) are skipped
+            if self._expiry.get(key) == expires_at:
+                del self._expiry[key]
+                self._data.pop(key, None)
+                n += 1
+        self.expired += n
+        return n
+
+    def _compact(self):
+        self._heap = [(exp, i, key) for i, (key, exp) in enumerate(self._expiry.items())]
+        heapq.heapify(self._heap)
+        self._seq = len(self._heap)
+
+    def memory_usage(self):
+        # Shallow container sizes plus each key/value; good enough to spot leaks
+        total = sys.getsizeof(self._data) + sys.getsizeof(self._expiry) + sys.getsizeof(self._heap)
+        total += len(self._heap) * sys.getsizeof((0.0, 0, None))
+        for key, value in self._data.items():
+            total += sys.getsizeof(key) + sys.getsizeof(value)
+        return total
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "bytes": self.memory_usage(),
+        }
+
+
+_MISSING = object()
@@ -0,0 +1,119 @@
+# storage.py
+
+import os
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    downloads INTEGER NOT NULL DEFAULT 0,
+    total_mb REAL NOT NULL DEFAULT 0,
+    last_download TEXT
+);
+CREATE TABLE IF NOT EXISTS insta_usage (
+    uid TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+# SQLite (WAL) backing store for user_data / insta_usage. Writes are per-user
+# upserts committed in a single transaction, so a crash never leaves a
+# half-written file behind.
+class UsageStore:
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.rows_written = 0
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def migrate_json(self, usage_file, insta_file):
+        # One-time import of the old whole-file JSON dumps
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return 0
+            users, insta = {}, {}
+            for path, target in ((usage_file, users), (insta_file, insta)):
+                try:
+                    if os.path.exists(path):
+                        with open(path, "r") as f:
+                            target.update(json.load(f))
+                except Exception as e:
+                    print(f"migrate_json: skipping {path}:", e)
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._upsert(users, insta)
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        for path in (usage_file, insta_file):
+            try:
+                if os.path.exists(path):
+                    os.replace(path, f"{path}.migrated")
+            except OSError:
+                pass
+        return len(users) + len(insta)
+
+    def load(self):
+        with self._lock:
+            users = {
+                uid: {"downloads": d, "total_mb": mb, "last_download": last}
+                for uid, d, mb, last in self._db.execute("SELECT uid, downloads, total_mb, last_download FROM users")
+            }
+            insta = {
+                uid: {"day": day, "count": count}
+                for uid, day, count in self._db.execute("SELECT uid, day, count FROM insta_usage")
+            }
+        return users, insta
+
+    def _upsert(self, users, insta):
+        self._db.executemany(
+            "INSERT INTO users (uid, downloads, total_mb, last_download) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(uid) DO UPDATE SET downloads=excluded.downloads, total_mb=excluded.total_mb, last_download=excluded.last_download",
+            [(uid, r.get("downloads", 0), r.get("total_mb", 0.0), r.get("last_download")) for uid, r in users.items()],
+        )
+        self._db.executemany(
+            "INSERT INTO insta_usage (uid, day, count) VALUES (?, ?, ?) "
+            "ON CONFLICT(uid) DO UPDATE SET day=excluded.day, count=excluded.count",
+            [(uid, r.get("day", ""), r.get("count", 0)) for uid, r in insta.items()],
+        )
+
+    def write(self, users, insta):
+        # users / insta hold only the records changed since the last flush
+        if not users and not insta:
+            return
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._upsert(users, insta)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self.flushes += 1
+            self.rows_written += len(users) + len(insta)
@@ -0,0 +1,113 @@
+# stream_upload.py
+
+import json
+import time
+import asyncio
+
+import aiohttp
+from aiohttp import payload
+
+# Pipelined download -> upload for media that needs no merge and no
+# postprocessing: the source response is read in chunks into a small bounded
+# queue and a multipart upload to the Bot API drains it as bytes arrive, so
+# the two phases overlap and nothing touches the disk. The source's
+# Content-Length is checked before the upload starts and becomes the upload's
+# Content-Length, so a short or oversized source fails the upload instead of
+# sending a broken file. Callers fall back to the download-to-disk path on
+# any error.
+
+CHUNK = 256 * 1024
+BUFFER_CHUNKS = 16  # ~4 MiB between the source and the upload
+
+
+class NotStreamable(Exception):
+    # Raised before any upload byte is sent: the source can't be piped as is
+    pass
+
+
+class UploadError(Exception):
+    # Bot API said no; error_code/result_json match what tg_governor.retry_after reads
+    def __init__(self, result_json):
+        super().__init__(f"Telegram error {result_json.get('error_code')}: {result_json.get('description')}")
+        self.error_code = result_json.get("error_code")
+        self.result_json = result_json
+
+
+class _SizedStream(payload.AsyncIterablePayload):
+    # The multipart writer only sets Content-Length when every part knows its size
+    def __init__(self, value, size, **kwargs):
+        super().__init__(value, **kwargs)
+        self._size = size
+
+
+class StreamUploader:
+    def __init__(self, http, api_url, max_bytes, chunk=CHUNK, buffer_chunks=BUFFER_CHUNKS):
+        self.http = http
+        self.api_url = api_url  # ".../bot<token>", never printed
+        self.max_bytes = max_bytes
+        self.chunk = chunk
+        self.buffer_chunks = buffer_chunks
+        self.streamed = 0
+        self.fallbacks = 0
+        self.bytes = 0
+
+    async def send(self, method, field, url, headers, filename, mime, params):
+        # -> (sent Message as a dict, bytes, seconds). Opens the source itself, so a retry starts over.
+        async with self.http.stream("GET", url, retries=1, headers=headers) as src:
+            if src.status != 200:
+                raise NotStreamable(f"source answered {src.status}")
+            size = src.content_length
+            if not size:
+                raise NotStreamable("source size unknown")
+            if size > self.max_bytes:
+                raise NotStreamable(f"source is {size} bytes")
+            queue = asyncio.Queue(self.buffer_chunks)
+            reader = asyncio.create_task(self._read(src, queue))
+            try:
+                with aiohttp.MultipartWriter("form-data") as form:
+                    for name, value in params.items():
+                        if value is not None:
+                            part = form.append(value if isinstance(value, str) else json.dumps(value))
+                            part.set_content_disposition("form-data", name=name)
+                    part = form.append_payload(_SizedStream(self._drain(queue, size), size, content_type=mime))
+                    part.set_content_disposition("form-data", name=field, filename=filename)
+                    started = time.monotonic()
+                    async with self.http.stream("POST", f"{self.api_url}/{method}", retries=0, data=form) as resp:
+                        body = await resp.json(content_type=None)
+            finally:
+                reader.cancel()
+        if not body.get("ok"):
+            raise UploadError(body)
+        self.streamed += 1
+        self.bytes += size
+        return body["result"], size, time.monotonic() - started
+
+    async def _read(self, src, queue):
+        try:
+            async for chunk in src.content.iter_chunked(self.chunk):
+                await queue.put(chunk)  # blocks while the upload is behind: the buffer stays bounded
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    async def _drain(self, queue, size):
+        sent = 0
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            sent += len(chunk)
+            if sent > size:
+                raise IOError("source sent more than its Content-Length")
+            yield chunk
+        if sent != size:
+            raise IOError(f"source ended after {sent} of {size} bytes")
+
+    def stats(self):
+        return {
+            "streamed": self.streamed,
+            "fallbacks": self.fallbacks,
+            "bytes": self.bytes,
+        }
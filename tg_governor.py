@@ -0,0 +1,202 @@
+# tg_governor.py
+
+import time
+import asyncio
+from collections import deque
+
+from state_store import TTLStore
+
+# Call priorities, lower goes first
+MEDIA = 0        # actual uploads / file sends
+INTERACTIVE = 1  # replies the user is waiting on
+COSMETIC = 2     # status message edits
+
+# Telegram's documented limits: ~30 msg/s overall, ~1 msg/s per chat, 20 msg/min per group
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+COSMETIC_RESERVE = 0.2  # share of the global bucket cosmetic edits may not dip into
+MAX_429_RETRIES = 3
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now, reserve=0.0):
+        self._refill(now)
+        need = 1 + reserve
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+def retry_after(exc):
+    # telebot's ApiTelegramException carries error_code and the raw result_json
+    if getattr(exc, "error_code", None) != 429:
+        return None
+    params = (getattr(exc, "result_json", None) or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+
+# Central gate for outbound Bot API calls. Every call takes a token from the
+# global bucket and from its chat's (and group's) bucket, 429 flood-waits
+# pause the affected chat instead of failing the job, and status edits are
+# coalesced per message so only the newest text is ever sent.
+class TelegramGovernor:
+    def __init__(self, bot, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, group_rate=GROUP_RATE):
+        self.bot = bot
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = TTLStore(600, 20000, "tg_chat_buckets")
+        self._groups = TTLStore(600, 5000, "tg_group_buckets")
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self._blocked_until = TTLStore(3600, 20000, "tg_flood_waits")  # chat_id (None = global) -> monotonic time, gone once passed
+        self._media_waiting = {}  # chat_id -> uploads waiting for a token
+        self._pending_edits = {}  # (chat_id, msg_id) -> (text, kwargs)
+        self._edit_tasks = {}
+        self.calls = 0
+        self.edits_sent = 0
+        self.edits_coalesced = 0
+        self.flood_waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._waits = deque(maxlen=512)
+
+    def _buckets(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, CHAT_BURST)
+        self._chats[chat_id] = bucket  # refresh TTL
+        buckets = [bucket]
+        if isinstance(chat_id, int) and chat_id < 0:
+            group = self._groups.get(chat_id)
+            if group is None:
+                group = TokenBucket(self.group_rate, GROUP_BURST)
+            self._groups[chat_id] = group
+            buckets.append(group)
+        return buckets
+
+    async def _acquire(self, chat_id, priority):
+        started = time.monotonic()
+        if priority == MEDIA:
+            self._media_waiting[chat_id] = self._media_waiting.get(chat_id, 0) + 1
+        try:
+            while True:
+                now = time.monotonic()
+                buckets = self._buckets(chat_id)
+                delay = max(self._blocked_until.get(chat_id, 0), self._blocked_until.get(None, 0)) - now
+                if priority > MEDIA and self._media_waiting.get(chat_id):
+                    delay = max(delay, 0.05)  # let this chat's uploads go first
+                reserve = self._global.capacity * COSMETIC_RESERVE if priority == COSMETIC else 0.0
+                delay = max([delay, self._global.delay(now, reserve)] + [b.delay(now) for b in buckets])
+                if delay <= 0:
+                    self._global.consume(now)
+                    for b in buckets:
+                        b.consume(now)
+                    break
+                await asyncio.sleep(delay)
+        finally:
+            if priority == MEDIA:
+                n = self._media_waiting.get(chat_id, 1) - 1
+                if n > 0:
+                    self._media_waiting[chat_id] = n
+                else:
+                    self._media_waiting.pop(chat_id, None)
+        self._record_wait(time.monotonic() - started)
+
+    def _record_wait(self, waited):
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self._waits.append(waited)
+
+    async def call(self, chat_id, fn, *args, priority=MEDIA, **kwargs):
+        for attempt in range(MAX_429_RETRIES + 1):
+            await self._acquire(chat_id, priority)
+            self.calls += 1
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                wait = retry_after(e)
+                if wait is None or attempt >= MAX_429_RETRIES:
+                    raise
+                self.flood_waits += 1
+                self._blocked_until.set(chat_id, time.monotonic() + wait, ttl=wait)
+                print(f"Telegram 429 for chat {chat_id}, retrying in {wait:.0f}s")
+
+    def edit(self, chat_id, msg_id, text, resend_on_fail=False, **kwargs):
+        # Fire-and-forget status edit; a newer text for the same message replaces a pending one
+        key = (chat_id, msg_id)
+        if key in self._pending_edits:
+            self.edits_coalesced += 1
+        self._pending_edits[key] = (text, resend_on_fail, kwargs)
+        if key not in self._edit_tasks:
+            self._edit_tasks[key] = asyncio.create_task(self._run_edits(key))
+
+    async def _run_edits(self, key):
+        chat_id, msg_id = key
+        try:
+            while key in self._pending_edits:
+                await self._acquire(chat_id, COSMETIC)
+                text, resend_on_fail, kwargs = self._pending_edits.pop(key)
+                try:
+                    await self._edit_with_retry(chat_id, msg_id, text, kwargs)
+                    self.edits_sent += 1
+                except Exception as e:
+                    if "message is not modified" in str(e):
+                        continue
+                    print(f"Status edit failed ({chat_id}/{msg_id}):", e)
+                    if resend_on_fail:
+                        try:
+                            await self.call(chat_id, self.bot.send_message, chat_id, text, priority=INTERACTIVE, **kwargs)
+                        except Exception:
+                            pass
+        finally:
+            self._edit_tasks.pop(key, None)
+
+    async def _edit_with_retry(self, chat_id, msg_id, text, kwargs):
+        for attempt in range(MAX_429_RETRIES + 1):
+            try:
+                return await self.bot.edit_message_text(text, chat_id, msg_id, **kwargs)
+            except Exception as e:
+                wait = retry_after(e)
+                if wait is None or attempt >= MAX_429_RETRIES:
+                    raise
+                self.flood_waits += 1
+                self._blocked_until.set(chat_id, time.monotonic() + wait, ttl=wait)
+                await self._acquire(chat_id, COSMETIC)
+                if (chat_id, msg_id) in self._pending_edits:
+                    return  # a newer text is queued, let the loop send that instead
+
+    async def flush(self, timeout):
+        # Shutdown: give queued status edits a chance to go out
+        tasks = list(self._edit_tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self):
+        waits = sorted(self._waits)
+        p95 = waits[int(len(waits) * 0.95)] if waits else 0.0
+        return {
+            "calls": self.calls,
+            "edits_sent": self.edits_sent,
+            "edits_coalesced": self.edits_coalesced,
+            "edits_pending": len(self._pending_edits),
+            "flood_waits": self.flood_waits,
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+            "wait_p95": p95,
+        }
@@ -0,0 +1,188 @@
+# url_router.py
+
+import re
+import asyncio
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import aiohttp
+
+from state_store import TTLStore
+
+# Link -> (platform, canonical post id). Hosts are matched on the parsed
+# hostname (so dropbox.com is not x.com), tracking parameters are dropped,
+# and short links (t.co, fb.watch, vm.tiktok.com, share links) are expanded
+# with a pooled HEAD request whose result is cached. The route key is the
+# same for every share of one post, and is what caches and deduplication
+# downstream are keyed on.
+
+DOMAINS = {
+    "instagram.com": "instagram",
+    "instagr.am": "instagram",
+    "twitter.com": "twitter",
+    "x.com": "twitter",
+    "t.co": "twitter",
+    "facebook.com": "facebook",
+    "fb.com": "facebook",
+    "fb.watch": "facebook",
+    "tiktok.com": "tiktok",
+}
+SHORT_HOSTS = {"t.co", "fb.watch", "vm.tiktok.com", "vt.tiktok.com"}
+SHORT_PATHS = {  # platform: path prefixes that only redirect to the post
+    "instagram": ("/share/",),
+    "facebook": ("/share/",),
+    "tiktok": ("/t/",),
+}
+POST_ID_RE = {
+    "instagram": re.compile(r"/(?:p|reels?|tv)/([\w-]+)"),
+    "twitter": re.compile(r"/status(?:es)?/(\d+)"),
+    "tiktok": re.compile(r"/(?:video|photo|embed(?:/v2)?)/(\d+)"),
+    "facebook": re.compile(r"/(?:reel|videos)/(?:[^/]+/)?(\d+)"),
+}
+ID_PARAMS = {"facebook": ("v", "story_fbid")}  # watch/?v=..., video.php?v=...
+TRACKING_PARAMS = {"si", "fbclid"}  # plus utm_*, dropped on every platform
+# Short names like s/t/ref are only share markers where listed; elsewhere
+# they can mean something (a start time, a page) and are kept
+PLATFORM_TRACKING_PARAMS = {
+    "instagram": {"igsh", "igshid"},
+    "twitter": {"s", "t"},
+    "tiktok": {"_r", "_t", "is_from_webapp", "sender_device"},
+    "facebook": {"mibextid", "ref", "rdid", "share_url"},
+}
+EXPAND_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"}
+
+
+class Route:
+    __slots__ = ("platform", "url", "post_id", "key")
+
+    def __init__(self, platform, url, post_id, key):
+        self.platform = platform
+        self.url = url          # what gets downloaded: the link minus tracking params
+        self.post_id = post_id  # None when the path has no recognisable id
+        self.key = key          # "<platform>:<post id>", or the normalized URL
+
+
+def _host(parts):
+    return (parts.hostname or "").lower().rstrip(".")
+
+def _clean_query(query, platform):
+    drop = TRACKING_PARAMS | PLATFORM_TRACKING_PARAMS.get(platform, set())
+    return [(k, v) for k, v in parse_qsl(query) if not (k.lower() in drop or k.lower().startswith("utm_"))]
+
+def _short(platform, host, path):
+    return host in SHORT_HOSTS or path.startswith(SHORT_PATHS.get(platform, ()))
+
+def post_id(platform, parts):
+    m = POST_ID_RE.get(platform) and POST_ID_RE[platform].search(parts.path)
+    if m:
+        return m.group(1)
+    params = dict(parse_qsl(parts.query))
+    for name in ID_PARAMS.get(platform, ()):
+        if params.get(name, "").isdigit():
+            return params[name]
+    return None
+
+
+class UrlRouter:
+    def __init__(self, http, extra_hosts=None, ttl=24 * 3600, failure_ttl=60, max_entries=5000, timeout=5):
+        self.http = http
+        self.extra_hosts = extra_hosts or {}  # exact host -> platform
+        self.failure_ttl = failure_ttl
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._expanded = TTLStore(ttl, max_entries, "short_links")  # short URL -> expanded URL
+        self._pending = {}  # short URL -> task, so a burst of shares costs one request
+        self.hits = 0
+        self.expansions = 0
+        self.failures = 0
+
+    # ===== Parsing (no network) =====
+    def platform(self, host):
+        if host in self.extra_hosts:
+            return self.extra_hosts[host]
+        for domain, platform in DOMAINS.items():
+            if host == domain or host.endswith("." + domain):
+                return platform
+        return None
+
+    def route(self, url):
+        try:
+            parts = urlsplit(url.strip())
+        except ValueError:
+            return None
+        if parts.scheme not in ("http", "https"):
+            return None
+        host = _host(parts)
+        platform = self.platform(host)
+        if not platform:
+            return None
+        query = _clean_query(parts.query, platform)
+        clean = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+        # Share-link paths can look like posts (/share/reel/<token>) but carry no post id
+        pid = None if host in self.extra_hosts or _short(platform, host, parts.path) else post_id(platform, parts)
+        if pid:
+            key = f"{platform}:{pid}"
+        else:
+            bare = host.split(".", 1)[1] if host.startswith(("www.", "m.", "mobile.")) else host
+            key = urlunsplit(("https", bare, parts.path.rstrip("/") or "/", urlencode(query), ""))
+        return Route(platform, clean, pid, key)
+
+    def key(self, url):
+        r = self.route(url)
+        return r.key if r else url
+
+    def is_short(self, url):
+        parts = urlsplit(url)
+        host = _host(parts)
+        return _short(self.platform(host), host, parts.path)
+
+    # ===== Resolution (expands short links) =====
+    async def resolve(self, url):
+        r = self.route(url)
+        if r is None or not self.is_short(r.url):
+            return r
+        target = await self.expand(r.url)
+        expanded = self.route(target) if target else None
+        if expanded and expanded.post_id and expanded.platform == r.platform:
+            return expanded
+        return r  # login wall or unknown shape: let yt-dlp follow the short link itself
+
+    async def expand(self, url):
+        cached = self._expanded.get(url)
+        if cached is not None:
+            self.hits += 1
+            return cached or None
+        task = self._pending.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._expand(url))
+            self._pending[url] = task
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _expand(self, url):
+        try:
+            target = await self._follow(url)
+        except Exception as e:
+            print(f"Short link expansion failed ({url}):", e)
+            target = None
+        if target:
+            self.expansions += 1
+            self._expanded.set(url, target)
+        else:
+            self.failures += 1
+            self._expanded.set(url, "", ttl=self.failure_ttl)  # retry soon, not on every share
+        return target
+
+    async def _follow(self, url):
+        async with self.http.stream("HEAD", url, retries=1, allow_redirects=True, headers=EXPAND_HEADERS, timeout=self.timeout) as resp:
+            if resp.status < 400 or resp.status == 404:
+                return str(resp.url)
+        # Some hosts refuse HEAD; the body of the GET is never read
+        async with self.http.stream("GET", url, retries=1, allow_redirects=True, headers=EXPAND_HEADERS, timeout=self.timeout) as resp:
+            return str(resp.url)
+
+    def stats(self):
+        return {
+            "cached": len(self._expanded),
+            "hits": self.hits,
+            "expansions": self.expansions,
+            "failures": self.failures,
+        }
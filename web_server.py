@@ -0,0 +1,111 @@
+# web_server.py
+
+import hmac
+import asyncio
+
+from aiohttp import web
+from telebot import types
+
+from metrics import REGISTRY
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# aiohttp server on the bot's own event loop. Always serves the health
+# endpoints (/, /ping, /ready, /metrics, /diagnostics when given a source and
+# a token); in webhook mode it also accepts Telegram updates, checks the
+# secret token, drops redeliveries by update_id and hands each update to the
+# bot as a task so the reply to Telegram is immediate.
+class WebServer:
+    def __init__(self, bot, readiness, webhook_path=None, secret=None, seen_updates=None, diagnostics=None, diag_token=None):
+        self.bot = bot
+        self.readiness = readiness        # () -> (ok, details dict)
+        self.webhook_path = webhook_path  # None = polling mode, no update route
+        self.secret = secret
+        self.seen_updates = seen_updates  # TTLStore of recent update_ids
+        self.diagnostics = diagnostics    # () -> dict, e.g. loop lag and stall stacks
+        self.diag_token = diag_token
+        self._tasks = set()
+        self._runner = None
+        self.updates = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.app = web.Application()
+        self.app.router.add_get("/", self.home)
+        self.app.router.add_get("/ping", self.ping)
+        self.app.router.add_get("/ready", self.ready)
+        self.app.router.add_get("/metrics", self.metrics)
+        if diagnostics and diag_token:
+            self.app.router.add_get("/diagnostics", self.diag)
+        if webhook_path:
+            self.app.router.add_post(webhook_path, self.webhook)
+
+    async def start(self, host, port):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        mode = "webhook" if self.webhook_path else "health only"
+        print(f"[*] Web server listening on {host}:{port} ({mode})")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def home(self, request):
+        return web.Response(text="I am alive!")  # Render can use this as basic health check
+
+    async def ping(self, request):
+        return web.Response(text="pong")
+
+    async def ready(self, request):
+        ok, details = self.readiness()
+        return web.json_response(dict(details, ready=ok), status=200 if ok else 503)
+
+    async def metrics(self, request):
+        return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": METRICS_CONTENT_TYPE})  # Prometheus scrape target
+
+    async def diag(self, request):
+        # Stack traces name files and code paths: not for anonymous callers
+        if not hmac.compare_digest(request.query.get("token", ""), self.diag_token):
+            raise web.HTTPUnauthorized()
+        return web.json_response(self.diagnostics())
+
+    async def webhook(self, request):
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            raise web.HTTPUnauthorized()
+        try:
+            data = await request.json()
+            update_id = data["update_id"]
+        except Exception:
+            self.rejected += 1
+            raise web.HTTPBadRequest()
+
+        # Telegram redelivers when it did not see a 200 in time
+        if self.seen_updates is not None:
+            if update_id in self.seen_updates:
+                self.duplicates += 1
+                return web.Response()
+            self.seen_updates[update_id] = True
+
+        self.updates += 1
+        task = asyncio.create_task(self._dispatch(data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _dispatch(self, data):
+        try:
+            await self.bot.process_new_updates([types.Update.de_json(data)])
+        except Exception as e:
+            print("Webhook update error:", e)
+
+    def stats(self):
+        return {
+            "updates": self.updates,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "dispatching": len(self._tasks),
+        }